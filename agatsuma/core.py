@@ -9,6 +9,7 @@ import re
 import signal
 
 from agatsuma import LoggingSystem
+from agatsuma.startup_profiler import StartupProfiler
 #from agatsuma import Spellbook
 
 major_version = 0
@@ -41,6 +42,9 @@ The following kwargs parameters are supported:
     #. `app_name` : Application name
     #. `application_spells` : names of namespaces to search spells inside
     #. `spell_directories` : additional (to `app_directory`) directories to search spells inside
+    #. `startup_profile` : enables :class:`agatsuma.startup_profiler.StartupProfiler`.
+       Summary is written into log when initialization is completed. If value is
+       a string it's used as path for JSON report.
 
 .. attribute:: instance
 
@@ -57,6 +61,12 @@ The following kwargs parameters are supported:
    Dict. For now contains only the key ``mode`` with value ``setup`` when core
    was started from setup.py and ``normal`` otherwise.
 
+.. attribute:: profiler
+
+   :class:`agatsuma.startup_profiler.StartupProfiler` instance. Should be used
+   to call spell callbacks during initialization (see :meth:`call_spells`),
+   so they will be measured when profiling is enabled.
+
     """
     version_string = "%d.%d.%d.%s.%s" % (major_version, minor_version, commits_count, branch_id, commit_id)
     internal_state = {"mode":"normal"}
@@ -75,6 +85,8 @@ The following kwargs parameters are supported:
     def __init__(self, app_name, app_config_path, **kwargs):
         self.logger = LoggingSystem()
         self.logger.core.info("Initializing Agatsuma v%s" % self.version_string)
+        startupProfile = kwargs.get("startup_profile", None)
+        self.profiler = StartupProfiler(enabled = bool(startupProfile))
         
         #update internal state
         Core.internal_state["mode"] = kwargs.get("app_mode", "normal")
@@ -83,7 +95,8 @@ The following kwargs parameters are supported:
         self.app_name = kwargs.get("app_name", None)
         
         #ok, we have all what we need and we can setup low level core extensions
-        self.setup_core_extensions(kwargs.get("core_extensions", []))
+        with self.profiler.phase("core_extensions"):
+            self.setup_core_extensions(kwargs.get("core_extensions", []))
 
         #i dont know what is it
         #self.registered_settings = {}
@@ -106,13 +119,12 @@ The following kwargs parameters are supported:
 #            from agatsuma.interfaces.abstract_spell import AbstractSpell
 #            log.core.info("Initializing spells...")
 #            allTheSpells = self.spellbook.implementations_of(AbstractSpell)
-#            for spell in allTheSpells:
-#                spell.pre_configure(self)
-#            self.settings = Settings(appConfig, self.registered_settings)
+#            self.call_spells("pre_configure", allTheSpells)
+#            with self.profiler.phase("settings"):
+#                self.settings = Settings(appConfig, self.registered_settings)
 #            self.logger.update_levels()
 #            log.core.info("Calling post-configure routines...")
-#            for spell in allTheSpells:
-#                spell.post_configure(self)
+#            self.call_spells("post_configure", allTheSpells)
 #            log.core.info("Spells initialization completed")
 #            self._post_configure()
 #            enumerator.eagerUnload()
@@ -124,13 +136,19 @@ The following kwargs parameters are supported:
         
         #alert all extensions, we're ready to play
         self.logger.core.debug("Post config extensions executing") 
-        for extension in self.extensions:
-            self.logger.core.debug("Executing of '%s'" % (extension.name()))
-            extension.on_core_post_configure(self)
+        with self.profiler.phase("extensions_post_configure"):
+            for extension in self.extensions:
+                self.logger.core.debug("Executing of '%s'" % (extension.name()))
+                with self.profiler.phase(extension.name()):
+                    extension.on_core_post_configure(self)
         self.logger.core.debug("Post config extensions executing completed")   
 
         
         self.logger.core.info("Initialization completed")
+        if self.profiler.enabled:
+            self.logger.core.info("Startup profile:\n%s" % self.profiler.summary())
+            if isinstance(startupProfile, basestring):
+                self.profiler.save(startupProfile)
         signal.signal(signal.SIGTERM, self._signal_handler)
 
     def setup_core_extensions(self, extensions, **kwargs):
@@ -143,7 +161,8 @@ The following kwargs parameters are supported:
             raise Exception("Not implemented yet") 
 #            self.logger("core").info("Instantiating core extension '%s'..." % extension_class.name())
 #            extension = extension_class()
-#            (app_directorys, appConfig, kwargs) = extension.init(self, None, None, kwargs)
+#            with self.profiler.phase("%s_init" % extension_class.name()):
+#                (app_directorys, appConfig, kwargs) = extension.init(self, None, None, kwargs)
 #            methods = extension.additional_methods()
 #            for method_name, method in methods:
 #                setattr(self, method_name, method)
@@ -151,6 +170,17 @@ The following kwargs parameters are supported:
 #            self.extensions.append(extension)
         
 
+    def call_spells(self, callback, spells):
+        '''
+        Calls method `callback` of every spell in `spells` with core as
+        argument. Calls are measured by startup profiler as phase `callback`
+        @param callback: name of spell's method (pre_configure, post_configure, etc.)
+        @param spells: list of spells
+        '''
+        with self.profiler.phase(callback):
+            for spell in spells:
+                self.profiler.spell_callback(spell, callback, self)
+
     def _signal_handler(self, signum, frame):
         self.logger.core.debug("Received signal %d, stopping..." % signum)
         self.stop()
@@ -165,7 +195,7 @@ The following kwargs parameters are supported:
             extension.on_core_stop(self)
         self._stop()
 
-#    def register_option(self, settingName, settingType, settingComment):
+#    def register_option(self, settingName, settingType, settingComment, **kwargs):
 #        """ This function must be called from
 #:meth:`agatsuma.interfaces.AbstractSpell.pre_configure`
 #
@@ -174,6 +204,7 @@ The following kwargs parameters are supported:
 #:param settingName: String contains of two *group name* and *option name* separated with dot (``group.option`` for example). Option will be threated as read-only if the string begins with exclamation mark.
 #:param settingType: type for option value. Allowed all types compatible with JSON.
 #:param settingComment: string with human-readable description for option
+#:param default: optional kwarg, value used when option is absent in config. Options without default are mandatory.
 #
 #See also **TODO**
 #"""
@@ -187,6 +218,8 @@ The following kwargs parameters are supported:
 #                            settingType,
 #                            settingComment,
 #                           )
+#            if 'default' in kwargs:
+#                settingDescr += (kwargs['default'], )
 #            fqn = match.group(2)
 #            if fqn in self.registered_settings:
 #                raise Exception("Setting is already registered: '%s' (%s)" % (fqn, settingComment))
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: elastic_pool
+   :synopsis: Worker pool which size depends on load
+"""
+
+import os
+import time
+import threading
+from multiprocessing.pool import Pool, ApplyResult, MaybeEncodingError, RUN
+
+from agatsuma import log
+
+# index of intermediate results in result messages, pool uses None as
+# index of apply_async() results
+PARTIAL = -1
+_partial = None
+
+def emit_partial(value):
+    """ Sends intermediate `value` of currently running task to main
+    process immediately. Value is passed to `partial` callback of
+    :meth:`ElasticPool.apply_async`, so this function may be called only
+    by tasks submitted with `partial` callback.
+    """
+    _partial(value)
+
+def _retire():
+    """ Task which makes worker process exit after completion """
+    return os.getpid()
+
+def _elastic_worker(inqueue, outqueue, initializer = None, initargs = (), maxtasks = None):
+    """ The same as :func:`multiprocessing.pool.worker` but exits after
+    :func:`_retire` task and allows tasks to send intermediate results
+    (see :func:`emit_partial`) """
+    global _partial
+    put = outqueue.put
+    get = inqueue.get
+    if hasattr(inqueue, '_writer'):
+        inqueue._writer.close()
+        outqueue._reader.close()
+
+    if initializer is not None:
+        initializer(*initargs)
+
+    completed = 0
+    while maxtasks is None or (maxtasks and completed < maxtasks):
+        try:
+            task = get()
+        except (EOFError, IOError):
+            break
+
+        if task is None:
+            break
+
+        job, i, func, args, kwds = task
+        _partial = lambda value: put((job, PARTIAL, (True, value)))
+        try:
+            result = (True, func(*args, **kwds))
+        except Exception, e:
+            result = (False, e)
+        try:
+            put((job, i, result))
+        except Exception, e:
+            put((job, i, (False, MaybeEncodingError(e, result[1]))))
+        if func is _retire:
+            break
+
+        task = job = result = func = args = kwds = None
+        completed += 1
+
+class StreamingResult(ApplyResult):
+    """ Result of task which sends intermediate results """
+
+    def __init__(self, cache, callback, partial):
+        ApplyResult.__init__(self, cache, callback)
+        self._partial = partial
+
+    def _set(self, i, obj):
+        if i != PARTIAL:
+            ApplyResult._set(self, i, obj)
+            return
+        try:
+            self._partial(obj[1])
+        except Exception, e:
+            # exception would stop pool's result handler thread
+            log.mpcore.error("Intermediate result handler failed: %s" % str(e))
+
+class ElasticPool(Pool):
+    """ Process pool which grows when tasks are queued and shrinks when
+    workers are idle.
+
+    Monitor thread checks pool every `check_interval` seconds. Pool grows
+    up to `max_processes` when there are more outstanding tasks than
+    workers. Growth is faster (all the backlog at once instead of one
+    worker per check) when average task latency (from submission to
+    completion) is greater than `scale_latency` seconds. When some
+    workers are idle for `idle_timeout` seconds one worker per check is
+    retired until pool size reaches `processes`.
+
+    Worker is retired by special task, so worker exits after completion of
+    the tasks it has already taken.
+
+    :param on_spawn: called with PID of every started worker (including
+        initial workers and replacements of dead ones).
+    :param on_retire: called with PID of every retired worker.
+
+    Callbacks are called from pool's internal threads, their exceptions
+    are logged and don't affect the pool.
+
+    Latency is measured from the time passed to :meth:`apply_async` as
+    `submitted`, so time which task spent waiting outside of pool is
+    taken into account.
+
+    Tasks waiting for pool outside of it (see
+    :class:`agatsuma.core_extensions.python_mp.task_dispatcher.TaskDispatcher`)
+    may be accounted by setting `extra_pending` attribute to callable
+    returning their number. `on_resize` attribute may be set to callable
+    which is called after pool is grown.
+    """
+    extra_pending = None
+    on_resize = None
+
+    def __init__(self, processes = None, initializer = None, initargs = (),
+                 max_processes = None, idle_timeout = 60, scale_latency = 1.0,
+                 check_interval = 1.0, on_spawn = None, on_retire = None):
+        self._scale_lock = threading.RLock()
+        self._on_spawn = on_spawn
+        self._on_retire = on_retire
+        self._retiring = 0
+        self._latency = 0.0
+        Pool.__init__(self, processes, initializer, initargs)
+        self._min_processes = self._processes
+        self._max_processes = max(max_processes or self._processes, self._processes)
+        self._idle_timeout = idle_timeout
+        self._scale_latency = scale_latency
+        self._check_interval = check_interval
+        self._monitor_stop = threading.Event()
+        if self._max_processes > self._min_processes:
+            self._monitor = threading.Thread(target = self._monitor_pool,
+                                             name = "PoolMonitor")
+            self._monitor.daemon = True
+            self._monitor.start()
+
+    def _repopulate_pool(self):
+        # called from worker handler thread and from monitor
+        with self._scale_lock:
+            started = len(self._pool)
+            Pool._repopulate_pool(self)
+            for process in self._pool[started:]:
+                self.__notify(self._on_spawn, process.pid)
+
+    def __notify(self, callback, pid):
+        if not callback:
+            return
+        try:
+            callback(pid)
+        except Exception, e:
+            log.mpcore.error("Worker %d event handler failed: %s" % (pid, str(e)))
+
+    def _maintain_pool(self):
+        with self._scale_lock:
+            Pool._maintain_pool(self)
+
+    def Process(self, *args, **kwds):
+        # Pool creates workers with module-level worker function
+        kwds['target'] = _elastic_worker
+        return Pool.Process(*args, **kwds)
+
+    def apply_async(self, func, args = (), kwds = {}, callback = None, submitted = None,
+                    partial = None):
+        """ The same as :meth:`multiprocessing.pool.Pool.apply_async`.
+        `partial` is called in main process with every intermediate result
+        sent by task with :func:`emit_partial`, all of them are received
+        before the final result.
+        """
+        submitted = submitted or time.time()
+        def measured(result):
+            # exponential moving average
+            self._latency = self._latency * 0.8 + (time.time() - submitted) * 0.2
+            if callback:
+                callback(result)
+        if partial is None:
+            return Pool.apply_async(self, func, args, kwds, measured)
+        assert self._state == RUN
+        result = StreamingResult(self._cache, measured, partial)
+        self._taskqueue.put(([(result._job, None, func, args, kwds)], None))
+        return result
+
+    def size(self):
+        """ Returns current number of workers excluding retiring ones """
+        return self._processes
+
+    def pending(self):
+        """ Returns number of submitted but not completed tasks """
+        pending = max(len(self._cache) - self._retiring, 0)
+        if self.extra_pending:
+            pending += self.extra_pending()
+        return pending
+
+    def latency(self):
+        """ Returns average task latency (seconds) """
+        return self._latency
+
+    def grow(self, count):
+        with self._scale_lock:
+            count = min(count, self._max_processes - self._processes)
+            if count <= 0 or self._state != RUN:
+                return 0
+            self._processes += count
+            self._repopulate_pool()
+        log.mpcore.info("Pool grown by %d to %d workers" % (count, self._processes))
+        if self.on_resize:
+            self.on_resize()
+        return count
+
+    def shrink(self):
+        with self._scale_lock:
+            if self._processes <= self._min_processes or self._state != RUN:
+                return False
+            self._processes -= 1
+            self._retiring += 1
+        Pool.apply_async(self, _retire, callback = self.__retired)
+        return True
+
+    def __retired(self, pid):
+        with self._scale_lock:
+            self._retiring -= 1
+        log.mpcore.info("Worker %d retired, pool size is %d" % (pid, self._processes))
+        self.__notify(self._on_retire, pid)
+
+    def _monitor_pool(self):
+        idleSince = None
+        while not self._monitor_stop.wait(self._check_interval) and self._state == RUN:
+            pending = self.pending()
+            workers = self._processes
+            if pending > workers:
+                idleSince = None
+                backlog = pending - workers
+                if self._latency <= self._scale_latency:
+                    backlog = 1
+                self.grow(backlog)
+            elif pending < workers:
+                now = time.time()
+                if idleSince is None:
+                    idleSince = now
+                elif now - idleSince >= self._idle_timeout and self.shrink():
+                    # next worker is retired after one more check
+                    idleSince = now - self._idle_timeout + self._check_interval
+            else:
+                idleSince = None
+
+    def close(self):
+        self._monitor_stop.set()
+        Pool.close(self)
+
+    def terminate(self):
+        self._monitor_stop.set()
+        Pool.terminate(self)
@@ -6,9 +6,16 @@
 """
 
 import os
+import errno
+import fcntl
+import random
+import select
+import shutil
+import socket
+import tempfile
 import threading
 import multiprocessing
-from multiprocessing import Pool, Manager
+from multiprocessing import Manager
 
 from agatsuma import Settings, log
 from agatsuma.errors import EAbstractFunctionCall
@@ -16,16 +23,34 @@ from agatsuma.core import Core
 from agatsuma.interfaces import IPoolEventSpell
 from agatsuma.interfaces import AbstractCoreExtension
 
+from settings_segment import SettingsSegment
+from elastic_pool import ElasticPool
+from task_dispatcher import TaskDispatcher
+from task_batcher import TaskBatcher
+
 """
      Base core extension providing pool of worker processes and able to
 notify them about settings changes.
 
 .. warning:: If you want to change settings from worker threads you should call :meth:`agatsuma.core.MPCore.start_settings_updater` recently after core initialization.
 
-``MPCore`` uses timer for updating settings in main process. It may be not really
-good if you using Agatsuma with another library which provides periodic
-callbacks. If so you should override method :meth:`agatsuma.core.MPCore.start_settings_updater`
-in core subclass and don't spawn unwanted thread.
+Process which changed settings puts changed options (delta) into shared dict,
+increments version counter placed in shared memory and sends notification
+datagram to every other process. Every process has one watcher thread which
+owns Unix datagram socket bound in directory created by main process and
+wakes up as soon as notification is received. Notifications are never
+waited for, so nothing depends on processes which may exit at any moment
+(workers are retired by elastic pool), sockets of exited processes are
+removed by publishers. Watchers also check the counter every
+``mpcore.settings_update_timeout`` seconds in case notification is lost,
+checking is plain memory read. Watcher of main process is stopped
+by :meth:`agatsuma.core.MultiprocessingCoreExtension.on_core_stop`. When ``mpcore.settings_segment_size`` is
+positive, config data is published into anonymous shared memory segment
+(see :class:`agatsuma.core_extensions.python_mp.settings_segment.SettingsSegment`)
+instead of manager's dict, so manager process is not involved into settings
+updates at all. If you don't want to spawn watcher thread
+in main process you should override method :meth:`agatsuma.core.MPCore.start_settings_updater`
+in core subclass.
 
 .. note:: The only way to shutdown multiprocessing application correctly from another application is sending of ``SIGTERM`` signal to main process.
 
@@ -38,12 +63,30 @@ in core subclass and don't spawn unwanted thread.
 class MultiprocessingCoreExtension(AbstractCoreExtension):
     config_update_manager = None
     shared_config_data = None
+    shared_config_version = None
+    config_lock = None
+    seen_config_version = 0
+    checkpoint_interval = 16
+    settings_segment = None
+    settings_watcher = None
+    watcher_stop = None
+    watcher_jitter = 0.1
+    watcher_max_backoff = 60
+    notify_dir = None
+    drain_timeout = 10
     pids = None
 
     def init(self, core, app_directorys, appConfig, kwargs):
         manager = Manager()
         MultiprocessingCoreExtension.config_update_manager = manager
         MultiprocessingCoreExtension.shared_config_data = manager.dict()
+        # Must be created before workers are forked. Version is raw shared
+        # memory, so checking it doesn't require any IPC, all writes are
+        # serialized by config_lock. Readers never take the lock
+        MultiprocessingCoreExtension.shared_config_version = multiprocessing.RawValue('L', 0)
+        MultiprocessingCoreExtension.config_lock = multiprocessing.Lock()
+        # sockets of all the processes are bound here, workers inherit path
+        MultiprocessingCoreExtension.notify_dir = tempfile.mkdtemp(prefix = "agatsuma-settings-")
         MultiprocessingCoreExtension.pids = manager.list()
 
         spell_directories = []
@@ -76,27 +119,64 @@ class MultiprocessingCoreExtension(AbstractCoreExtension):
         #self._pre_pool_init() # TODO: XXX:
         poolEventSpells = core.spellbook.implementations_of(IPoolEventSpell)
         for spell in poolEventSpells:
-            spell.pre_pool_init(core)
+            core.profiler.spell_callback(spell, "pre_pool_init", core)
+
+        segmentSize = Settings.mpcore.settings_segment_size
+        if segmentSize > 0:
+            # workers will inherit the mapping
+            segment = SettingsSegment(segmentSize)
+            segment.write(Settings.settings, MultiprocessingCoreExtension.shared_config_version.value)
+            MultiprocessingCoreExtension.settings_segment = segment
+            log.mpcore.debug("Config data is shared using %d bytes memory segment" % segmentSize)
 
         core.pool = None
+        core.dispatcher = None
+        core.batcher = None
         workers = Settings.mpcore.workers
         if workers >= 0:
-            log.mpcore.debug("Starting %d workers..." % workers)
-            core.pool = Pool(processes=workers,
-                             initializer = _worker_initializer,
-                             initargs = (Settings.mpcore.settings_update_timeout, ))
+            log.mpcore.debug("Starting %d workers (up to %d)..." % (workers, Settings.mpcore.max_workers))
+            with core.profiler.phase("pool_start"):
+                core.pool = ElasticPool(processes = workers,
+                                        initializer = _worker_initializer,
+                                        initargs = (Settings.mpcore.settings_update_timeout, ),
+                                        max_processes = Settings.mpcore.max_workers,
+                                        idle_timeout = Settings.mpcore.worker_idle_timeout,
+                                        scale_latency = Settings.mpcore.scale_latency,
+                                        on_spawn = lambda pid: self._worker_event(core, "on_worker_spawn", pid),
+                                        on_retire = lambda pid: self._worker_event(core, "on_worker_retire", pid))
+            core.dispatcher = TaskDispatcher(core.pool, Settings.mpcore.task_queues)
+            core.batcher = TaskBatcher(core.dispatcher,
+                                       Settings.mpcore.batch_window / 1000.0,
+                                       Settings.mpcore.batch_size)
         else:
             log.mpcore.info("Pool initiation skipped due negative workers count")
 
         log.mpcore.info("Calling post-pool-init routines...")
         for spell in poolEventSpells:
-            spell.post_pool_init(core)
+            core.profiler.spell_callback(spell, "post_pool_init", core)
         self.pool = core.pool
 
+    def _worker_event(self, core, event, pid):
+        if event == "on_worker_retire":
+            MultiprocessingCoreExtension.forget_pid(pid)
+        for spell in core.spellbook.implementations_of(IPoolEventSpell):
+            getattr(spell, event)(core, pid)
+
     def on_core_stop(self, core):
+        MultiprocessingCoreExtension._stop_settings_watcher()
+        if core.batcher:
+            core.batcher.stop()
+        if core.dispatcher:
+            # pool is closed right after, so tasks must be completed before
+            dropped, running = core.dispatcher.drain(MultiprocessingCoreExtension.drain_timeout)
+            if dropped or running:
+                log.mpcore.warning("%d queued tasks dropped and %d running tasks abandoned on stop" %
+                                   (dropped, running))
         if core.pool:
             core.pool.close()
         self.removePidFile()
+        if MultiprocessingCoreExtension.notify_dir:
+            shutil.rmtree(MultiprocessingCoreExtension.notify_dir, ignore_errors = True)
 
 ################################################
     # TODO: XXX: one method enough
@@ -108,13 +188,33 @@ class MultiprocessingCoreExtension(AbstractCoreExtension):
     @staticmethod
     def write_pid(pid):
         log.mpcore.debug("Writing PID %d" % pid)
-        mode = "a+"
-        pidfile = Settings.mpcore.pidfile
-        if not os.path.exists(pidfile):
-            mode = "w+"
-        f = open(pidfile, mode)
-        f.write("%d\n" % pid)
-        f.close()
+        f = open(Settings.mpcore.pidfile, "a")
+        try:
+            # pidfile is changed by workers and by main process, lock is
+            # released by OS even if process dies
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write("%d\n" % pid)
+        finally:
+            f.close()
+
+    @staticmethod
+    def forget_pid(pid):
+        """ Removes PID of exited process from PIDs list and pidfile """
+        pids = MultiprocessingCoreExtension.pids
+        if pid in pids:
+            pids.remove(pid)
+        try:
+            f = open(Settings.mpcore.pidfile, "r+")
+        except IOError:
+            return
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            lines = filter(lambda line: line.strip() != str(pid), f.readlines())
+            f.seek(0)
+            f.truncate()
+            f.writelines(lines)
+        finally:
+            f.close()
 
     @staticmethod
     def removePidFile():
@@ -134,39 +234,294 @@ class MultiprocessingCoreExtension(AbstractCoreExtension):
     def _start_settings_updater(self):
         raise EAbstractFunctionCall()
 
+    @staticmethod
+    def publish_config(configData):
+        """ Puts new config into shared storage and increments shared
+        version, so settings watchers of all the processes will install it.
+
+        When settings segment is enabled the whole config is written into it
+        as new generation. Otherwise see :meth:`_store_delta`.
+        """
+        lock = MultiprocessingCoreExtension.config_lock
+        lock.acquire()
+        try:
+            sharedVersion = MultiprocessingCoreExtension.shared_config_version
+            version = sharedVersion.value + 1
+            segment = MultiprocessingCoreExtension.settings_segment
+            if segment:
+                segment.write(configData["data"], version)
+            else:
+                MultiprocessingCoreExtension._store_delta(configData, version)
+            sharedVersion.value = version
+            # this process already has this config
+            MultiprocessingCoreExtension.seen_config_version = version
+        finally:
+            lock.release()
+        MultiprocessingCoreExtension._notify_watchers()
+
+    @staticmethod
+    def _notify_path(pid):
+        return os.path.join(MultiprocessingCoreExtension.notify_dir, str(pid))
+
+    @staticmethod
+    def _notify_watchers():
+        """ Wakes up settings watchers of all the other processes. Datagram
+        is sent without waiting: when receiver's queue is full it already
+        has notification to process. Sockets nobody listens to are left by
+        exited processes, they are removed.
+        """
+        notifyDir = MultiprocessingCoreExtension.notify_dir
+        if not notifyDir:
+            return
+        ownName = str(os.getpid())
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            for name in os.listdir(notifyDir):
+                if name == ownName:
+                    continue
+                path = os.path.join(notifyDir, name)
+                try:
+                    sender.sendto("\x01", socket.MSG_DONTWAIT, path)
+                except socket.error, e:
+                    if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                        try:
+                            os.unlink(path)
+                        except OSError:
+                            pass
+                    elif not e.errno in (errno.EAGAIN, errno.ENOBUFS):
+                        log.mpcore.warning("Config update notification was not sent to %s: %s" % (name, str(e)))
+        except OSError, e:
+            log.mpcore.warning("Config update notifications were not sent: %s" % str(e))
+        finally:
+            sender.close()
+
+    @staticmethod
+    def _store_delta(configData, version):
+        """ Only delta (changed options) is stored in manager's dict for
+        every version, full config is stored as checkpoint every
+        :attr:`checkpoint_interval` versions. Deltas older than the previous
+        checkpoint are removed, so shared storage doesn't grow.
+        """
+        shared = MultiprocessingCoreExtension.shared_config_data
+        shared[("delta", version)] = configData["delta"]
+        if version % MultiprocessingCoreExtension.checkpoint_interval == 1:
+            previous = shared.get("checkpoint", None)
+            shared["checkpoint"] = {"data" : configData["data"],
+                                    "version" : version,
+                                   }
+            if previous:
+                # deltas made after previous checkpoint are kept for
+                # processes which are slightly behind
+                interval = MultiprocessingCoreExtension.checkpoint_interval
+                for oldVersion in range(max(1, previous["version"] - interval + 1),
+                                        previous["version"] + 1):
+                    shared.pop(("delta", oldVersion), None)
+        shared["update"] = configData["update"]
+
+    @staticmethod
+    def _collect_changes(seenVersion, lastVersion):
+        """ Returns settings dict (see :meth:`agatsuma.Settings.set_config_data`)
+        containing all the changes made after `seenVersion` up to
+        `lastVersion` or ``None`` if publisher has replaced checkpoint
+        meanwhile. Deltas are merged, so every option is installed once.
+        """
+        shared = MultiprocessingCoreExtension.shared_config_data
+        deltas = []
+        version = lastVersion
+        while version > seenVersion:
+            delta = shared.get(("delta", version), None)
+            if delta is None:
+                break
+            deltas.append(delta)
+            version -= 1
+        settings = {}
+        if version > seenVersion:
+            # some deltas are already removed, starting from checkpoint
+            checkpoint = shared.get("checkpoint", None)
+            if not checkpoint or not version <= checkpoint["version"] <= lastVersion:
+                return None
+            for groupName, values in checkpoint["data"].items():
+                settings[groupName] = dict(values)
+            deltas = deltas[:lastVersion - checkpoint["version"]]
+        merged = {}
+        for delta in reversed(deltas):
+            merged.update(delta)
+        for groupName, values in Settings.delta_to_settings(merged).items():
+            settings.setdefault(groupName, {}).update(values)
+        return settings
+
     @staticmethod
     def _update_settings():
         # Settings in current thread are in old state
-        # If we detect, that shared object has updated config we replace it
+        # If we detect, that shared object has updated config we apply
+        # all the missed changes at once
+        seenVersion = MultiprocessingCoreExtension.seen_config_version
+        if MultiprocessingCoreExtension.shared_config_version.value <= seenVersion:
+            return
+        segment = MultiprocessingCoreExtension.settings_segment
+        if segment:
+            MultiprocessingCoreExtension._update_settings_from_segment(segment)
+            return
+        settings = None
+        while settings is None:
+            # publisher may replace checkpoint while we are reading deltas,
+            # changes are collected again up to the newer version then
+            lastVersion = MultiprocessingCoreExtension.shared_config_version.value
+            settings = MultiprocessingCoreExtension._collect_changes(seenVersion, lastVersion)
         process = multiprocessing.current_process()
         thread = threading.currentThread()
-        log.mpcore.info("Checking for config updates in process '%s' with PID %s using thread '%s'..."
-                          % (str(process.name), process.pid, thread.getName()))
-
-        prevUpdate = Settings.configData['update']
-        lastUpdate = MultiprocessingCoreExtension.shared_config_data['update']
-        if (prevUpdate < lastUpdate):
-            process = multiprocessing.current_process()
-            thread = threading.currentThread()
-            log.mpcore.info("Process '%s' with PID %s received new config, updating using thread '%s'..."
-                          % (str(process.name), process.pid, thread.getName()))
-            #Core.settings.parse_settings(Core.shared_config_data['data'], Settings.descriptors)
-            Settings.set_config_data(MultiprocessingCoreExtension.shared_config_data['data'], update_shared = False)
+        log.mpcore.info("Process '%s' with PID %s received config versions %d-%d, updating using thread '%s'..."
+                      % (str(process.name), process.pid, seenVersion + 1, lastVersion, thread.getName()))
+        MultiprocessingCoreExtension.seen_config_version = lastVersion
+        Settings.set_config_data(settings,
+                                 version = lastVersion,
+                                 update_shared = False)
+
+    @staticmethod
+    def _update_settings_from_segment(segment):
+        data, version = segment.read()
+        if version <= MultiprocessingCoreExtension.seen_config_version:
+            return
+        process = multiprocessing.current_process()
+        log.mpcore.info("Process '%s' with PID %s received config version %d from settings segment"
+                      % (str(process.name), process.pid, version))
+        MultiprocessingCoreExtension.seen_config_version = version
+        Settings.set_config_data(data, version = version, update_shared = False)
+
+    @staticmethod
+    def _open_notify_socket():
+        """ Returns datagram socket receiving notifications for current
+        process or ``None`` if notifications are not available """
+        if not MultiprocessingCoreExtension.notify_dir:
+            return None
+        path = MultiprocessingCoreExtension._notify_path(os.getpid())
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            if os.path.exists(path):
+                # left by exited process with the same PID
+                os.unlink(path)
+            sock.bind(path)
+        except (socket.error, OSError), e:
+            log.mpcore.warning("Config update notifications are not available, polling: %s" % str(e))
+            sock.close()
+            return None
+        sock.setblocking(False)
+        return sock
+
+    @staticmethod
+    def _wait_notification(sock, stop, timeout):
+        """ Waits up to `timeout` seconds for notification """
+        if sock is None:
+            stop.wait(timeout)
+            return
+        try:
+            select.select([sock], [], [], timeout)
+            while True:
+                sock.recv(64)
+        except socket.error, e:
+            if e.errno != errno.EAGAIN:
+                raise
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+
+    @staticmethod
+    def _watch_settings(timeout, apply, stop, sock):
+        """ Body of settings watcher thread. `apply` is called when new config
+        is available and it should call
+        :meth:`MultiprocessingCoreExtension._update_settings`. By default
+        config is installed directly in watcher thread.
+
+        Watcher wakes up when notification is received on `sock` or every
+        `timeout` seconds. Interval is randomized by :attr:`watcher_jitter`
+        (fraction of `timeout`) so watchers of different processes don't
+        wake up simultaneously. If `apply` fails (eg. manager process is
+        unreachable) it's retried with exponential backoff limited by
+        :attr:`watcher_max_backoff` seconds, notifications are ignored
+        meanwhile. Thread exits when `stop` event is set.
+        """
+        apply = apply or MultiprocessingCoreExtension._update_settings
+        jitter = MultiprocessingCoreExtension.watcher_jitter
+        knownVersion = MultiprocessingCoreExtension.seen_config_version
+        backoff = 0
+        try:
+            while not stop.isSet():
+                interval = (backoff or timeout) * random.uniform(1 - jitter, 1 + jitter)
+                if backoff:
+                    stop.wait(interval)
+                else:
+                    MultiprocessingCoreExtension._wait_notification(sock, stop, interval)
+                if stop.isSet():
+                    break
+                version = MultiprocessingCoreExtension.shared_config_version.value
+                if version <= knownVersion:
+                    continue
+                try:
+                    apply()
+                except Exception, e:
+                    backoff = min(max(backoff * 2, 1), MultiprocessingCoreExtension.watcher_max_backoff)
+                    log.mpcore.error("Config update failed, retrying in %ds: %s" % (backoff, str(e)))
+                    continue
+                backoff = 0
+                knownVersion = version
+        finally:
+            if sock:
+                sock.close()
+                try:
+                    os.unlink(MultiprocessingCoreExtension._notify_path(os.getpid()))
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _start_settings_watcher(timeout, apply = None):
+        """ Starts settings watcher thread in current process. Only one
+        watcher per process is running.
+        """
+        watcher = MultiprocessingCoreExtension.settings_watcher
+        if watcher and watcher.isAlive():
+            return watcher
+        # events, sockets and threads are not inherited from parent process
+        stop = threading.Event()
+        sock = MultiprocessingCoreExtension._open_notify_socket()
+        watcher = threading.Thread(target = MultiprocessingCoreExtension._watch_settings,
+                                   args = (timeout, apply, stop, sock),
+                                   name = "SettingsWatcher")
+        watcher.daemon = True
+        MultiprocessingCoreExtension.watcher_stop = stop
+        MultiprocessingCoreExtension.settings_watcher = watcher
+        watcher.start()
+        return watcher
+
+    @staticmethod
+    def _stop_settings_watcher(timeout = 5):
+        """ Stops settings watcher thread of current process and waits
+        `timeout` seconds for it
+        """
+        watcher = MultiprocessingCoreExtension.settings_watcher
+        if not watcher or not watcher.isAlive():
+            return
+        MultiprocessingCoreExtension.watcher_stop.set()
+        # wakes watcher up if it's waiting for notification
+        if MultiprocessingCoreExtension.notify_dir:
+            sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            try:
+                sender.sendto("\x00", socket.MSG_DONTWAIT,
+                              MultiprocessingCoreExtension._notify_path(os.getpid()))
+            except socket.error:
+                pass
+            sender.close()
+        watcher.join(timeout)
+        if watcher.isAlive():
+            log.mpcore.warning("Settings watcher was not stopped in %ds" % timeout)
+        MultiprocessingCoreExtension.settings_watcher = None
 
 def _worker_initializer(timeout):
     process = multiprocessing.current_process()
     MultiprocessingCoreExtension.remember_pid(process.pid)
     MultiprocessingCoreExtension.write_pid(process.pid)
-    log.mpcore.debug("Initializing worker process '%s' with PID %d. Starting config update checker with %ds timeout" % (str(process.name), process.pid, timeout))
-    MPStandaloneExtension._update_settings_by_timer(timeout)
+    log.mpcore.debug("Initializing worker process '%s' with PID %d. Starting config watcher with %ds timeout" % (str(process.name), process.pid, timeout))
+    MultiprocessingCoreExtension._start_settings_watcher(timeout)
 
 class MPStandaloneExtension(MultiprocessingCoreExtension):
     def _start_settings_updater(self):
-        MPStandaloneExtension._update_settings_by_timer(Settings.mpcore.settings_update_timeout)
-
-    @staticmethod
-    def _update_settings_by_timer(timeout):
-        if Core.instance.shutdown:
-            return
-        threading.Timer(timeout, MPStandaloneExtension._update_settings_by_timer, (timeout, )).start()
-        MultiprocessingCoreExtension._update_settings()
+        MultiprocessingCoreExtension._start_settings_watcher(Settings.mpcore.settings_update_timeout)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: settings_segment
+   :synopsis: Shared memory segment with config data
+"""
+
+import mmap
+import json
+import struct
+
+from agatsuma.settings import str_keys
+
+class SettingsSegment(object):
+    """ Anonymous shared memory segment holding serialized config data.
+
+    Segment must be created before worker processes are forked, all the
+    forked processes map the same memory. Segment consists of header and
+    two slots. Writer serializes config into inactive slot and then
+    switches active slot in header, so readers never see partially
+    written data. Header is protected by sequence counter: writer makes
+    it odd while header is being changed and readers retry when counter
+    is odd or was changed while they were reading.
+
+    Writers must be serialized by caller (see
+    :meth:`agatsuma.core.MultiprocessingCoreExtension.publish_config`).
+
+    :param size: total segment size in bytes. Every slot gets a bit less
+        than half of it.
+    """
+    magic = "AGSS"
+    header = struct.Struct("<4sQQII")
+    slots_offset = 32
+
+    def __init__(self, size):
+        self.size = size
+        self.slot_size = (size - SettingsSegment.slots_offset) // 2
+        if self.slot_size <= 0:
+            raise Exception("Settings segment size %d is too small" % size)
+        self.memory = mmap.mmap(-1, size)
+        SettingsSegment.header.pack_into(self.memory, 0, SettingsSegment.magic, 0, 0, 0, 0)
+
+    def __slot_offset(self, slot):
+        return SettingsSegment.slots_offset + slot * self.slot_size
+
+    def __read_header(self):
+        return SettingsSegment.header.unpack_from(self.memory, 0)
+
+    def __write_header(self, sequence, version, active, length):
+        SettingsSegment.header.pack_into(self.memory, 0, SettingsSegment.magic,
+                                         sequence, version, active, length)
+
+    def write(self, data, version):
+        """ Stores config `data` of `version` as new generation """
+        payload = json.dumps(data, separators = (',', ':'))
+        if type(payload) is unicode:
+            payload = payload.encode('utf-8')
+        if len(payload) > self.slot_size:
+            raise Exception("Config data (%d bytes) doesn't fit into settings segment slot (%d bytes)" %
+                            (len(payload), self.slot_size))
+        magic, sequence, oldVersion, active, length = self.__read_header()
+        inactive = 1 - active
+        offset = self.__slot_offset(inactive)
+        self.memory[offset:offset + len(payload)] = payload
+        self.__write_header(sequence + 1, oldVersion, active, length)
+        self.__write_header(sequence + 2, version, inactive, len(payload))
+
+    def version(self):
+        """ Returns version of the last written config. Doesn't copy
+        anything except header
+        """
+        while True:
+            magic, sequence, version, active, length = self.__read_header()
+            if not sequence & 1:
+                return version
+
+    def read(self):
+        """ Returns tuple ``(data, version)`` of the last written config or
+        ``(None, 0)`` if nothing was written yet
+        """
+        while True:
+            magic, sequence, version, active, length = self.__read_header()
+            if sequence & 1:
+                continue
+            if not sequence:
+                return (None, 0)
+            offset = self.__slot_offset(active)
+            payload = self.memory[offset:offset + length]
+            if SettingsSegment.header.unpack_from(self.memory, 0)[1] == sequence:
+                # names of groups and options must be str like in
+                # config loaded by Settings
+                return (json.loads(payload, object_hook = str_keys), version)
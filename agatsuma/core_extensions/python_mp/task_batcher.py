@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: task_batcher
+   :synopsis: Coalescing of small tasks into batches
+"""
+
+import time
+import threading
+import traceback
+
+from agatsuma import log
+
+from elastic_pool import emit_partial
+
+def _run_batch(tasks):
+    """ Runs batch of tasks in worker process. Result of every task is
+    sent to main process as soon as task is completed as
+    ``(index, success, result or traceback text)`` tuple, so slow task
+    doesn't delay results of the tasks completed before it """
+    for index, (method, args) in enumerate(tasks):
+        try:
+            result = (index, True, method(*args))
+        except Exception:
+            result = (index, False, traceback.format_exc())
+        emit_partial(result)
+
+class TaskBatcher(object):
+    """ Collects tasks submitted to the same queue during `window` seconds
+    (or until `size` tasks are collected) and sends them to worker as one
+    task of :class:`agatsuma.core_extensions.python_mp.task_dispatcher.TaskDispatcher`,
+    so all the tasks of batch are pickled and transferred to worker at
+    once. Results are streamed back: callback of every task is called in
+    main process as soon as the task is completed, in order of submission.
+
+    Batches are flushed by one background thread.
+    """
+
+    def __init__(self, dispatcher, window, size):
+        self.dispatcher = dispatcher
+        self.window = window
+        self.size = size
+        self.batches_sent = 0
+        self.tasks_sent = 0
+        self.__batches = {}
+        self.__stopped = False
+        self.__condition = threading.Condition()
+        self.__flusher = threading.Thread(target = self.__run, name = "TaskBatcher")
+        self.__flusher.daemon = True
+        self.__flusher.start()
+
+    def submit(self, queueName, method, args, callback):
+        """ Adds task into batch for queue `queueName`. `callback` is called
+        with result of ``method(*args)`` in main process. Failed tasks are
+        logged and `callback` is not called.
+        """
+        queueName = queueName or self.dispatcher.default_queue
+        if not queueName in self.dispatcher.queues:
+            raise Exception("Unknown task queue '%s'" % queueName)
+        full = None
+        self.__condition.acquire()
+        try:
+            batch = self.__batches.get(queueName, None)
+            if batch is None:
+                batch = ([], time.time() + self.window)
+                self.__batches[queueName] = batch
+                self.__condition.notify()
+            batch[0].append((method, args, callback))
+            if len(batch[0]) >= self.size:
+                full = self.__batches.pop(queueName)[0]
+        finally:
+            self.__condition.release()
+        if full:
+            self.__flush(queueName, full)
+
+    def __flush(self, queueName, batch):
+        callbacks = map(lambda task: task[2], batch)
+        def completed(result):
+            index, success, value = result
+            if success:
+                callbacks[index](value)
+            else:
+                log.mpcore.error("Batched task from queue '%s' failed: %s" % (queueName, value))
+        self.batches_sent += 1
+        self.tasks_sent += len(batch)
+        self.dispatcher.submit(queueName,
+                               _run_batch,
+                               (map(lambda task: task[:2], batch), ),
+                               lambda result: None,
+                               partial = completed)
+
+    def __run(self):
+        self.__condition.acquire()
+        try:
+            while not self.__stopped:
+                if not self.__batches:
+                    self.__condition.wait()
+                    continue
+                now = time.time()
+                due = filter(lambda queueName: self.__batches[queueName][1] <= now,
+                             self.__batches.keys())
+                if not due:
+                    nearest = min(map(lambda batch: batch[1], self.__batches.values()))
+                    self.__condition.wait(nearest - now)
+                    continue
+                batches = map(lambda queueName: (queueName, self.__batches.pop(queueName)[0]),
+                              due)
+                self.__condition.release()
+                try:
+                    for queueName, batch in batches:
+                        self.__flush(queueName, batch)
+                finally:
+                    self.__condition.acquire()
+        finally:
+            self.__condition.release()
+
+    def stop(self):
+        """ Flushes all the collected tasks and stops background thread """
+        self.__condition.acquire()
+        try:
+            self.__stopped = True
+            batches = self.__batches.items()
+            self.__batches = {}
+            self.__condition.notify()
+        finally:
+            self.__condition.release()
+        for queueName, (batch, deadline) in batches:
+            self.__flush(queueName, batch)
+        self.__flusher.join()
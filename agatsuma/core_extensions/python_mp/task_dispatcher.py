@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: task_dispatcher
+   :synopsis: Named priority queues in front of worker pool
+"""
+
+import time
+import threading
+import traceback
+from collections import deque
+
+from agatsuma import log
+
+def _call(method, args):
+    """ Runs task in worker process. Exceptions are returned as text, so
+    dispatcher always knows when task is completed """
+    try:
+        return (True, method(*args))
+    except Exception:
+        return (False, traceback.format_exc())
+
+class TaskQueue(object):
+    """ Queue of tasks waiting for worker and its statistics """
+
+    def __init__(self, name, priority = 0, reserved = 0):
+        self.name = name
+        self.priority = priority
+        self.reserved = reserved
+        self.tasks = deque()
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.wait_time = 0.0
+        self.run_time = 0.0
+
+    def stats(self):
+        """ Returns dict with queue depth, number of running tasks, counters
+        and average (exponential moving average) times (in seconds) which
+        tasks spend waiting in queue and running in worker
+        """
+        return {"depth" : len(self.tasks),
+                "running" : self.running,
+                "submitted" : self.submitted,
+                "completed" : self.completed,
+                "failed" : self.failed,
+                "max_depth" : self.max_depth,
+                "wait_time" : self.wait_time,
+                "run_time" : self.run_time,
+               }
+
+class TaskDispatcher(object):
+    """ Dispatches tasks submitted to named queues into worker pool.
+
+    Dispatcher never gives pool more tasks than it has workers, so tasks
+    are waiting in dispatcher's queues and the next task is always taken
+    from the queue with the highest priority (FIFO inside queue). Queue
+    may reserve some workers: tasks from other queues are never started
+    when it would leave less free workers than total reservation of
+    queues which are running less tasks than they reserved.
+
+    :param pool: :class:`agatsuma.core_extensions.python_mp.elastic_pool.ElasticPool`
+        instance.
+    :param queues: dict which maps queue names to dicts with optional
+        ``priority`` (higher is dispatched first, 0 by default) and
+        ``reserved`` (number of workers reserved for queue, 0 by default)
+        keys. Queue ``default`` is always available.
+
+    Total reservation should be less than minimal pool size, otherwise
+    queues without reservation may wait until pool grows.
+    """
+    default_queue = "default"
+
+    def __init__(self, pool, queues):
+        self.pool = pool
+        self.queues = {}
+        self.__lock = threading.Lock()
+        self.__idle = threading.Condition(self.__lock)
+        queues = dict(queues)
+        queues.setdefault(TaskDispatcher.default_queue, {})
+        for name, options in queues.items():
+            self.queues[name] = TaskQueue(name,
+                                          options.get("priority", 0),
+                                          options.get("reserved", 0))
+        self.__ordered = sorted(self.queues.values(),
+                                key = lambda queue: queue.priority,
+                                reverse = True)
+        pool.extra_pending = self.waiting
+        pool.on_resize = self.__dispatch
+
+    def waiting(self):
+        """ Returns number of tasks waiting for worker in all the queues """
+        return sum(map(lambda queue: len(queue.tasks), self.__ordered))
+
+    def stats(self):
+        return dict(map(lambda queue: (queue.name, queue.stats()), self.__ordered))
+
+    def submit(self, queueName, method, args, callback, partial = None):
+        """ Puts task into queue `queueName`. `callback` is called with
+        result of ``method(*args)`` in main process (from pool's result
+        thread). Failed tasks are logged and `callback` is not called.
+        `partial` is called with intermediate results of the task (see
+        :func:`agatsuma.core_extensions.python_mp.elastic_pool.emit_partial`).
+        """
+        queue = self.queues.get(queueName or TaskDispatcher.default_queue, None)
+        if queue is None:
+            raise Exception("Unknown task queue '%s'" % queueName)
+        self.__lock.acquire()
+        try:
+            queue.tasks.append((method, args, callback, partial, time.time()))
+            queue.submitted += 1
+            queue.max_depth = max(queue.max_depth, len(queue.tasks))
+        finally:
+            self.__lock.release()
+        self.__dispatch()
+
+    def __running(self):
+        return sum(map(lambda queue: queue.running, self.__ordered))
+
+    def drain(self, timeout):
+        """ Waits up to `timeout` seconds until all the queued and running
+        tasks are completed and their callbacks are called. Tasks still
+        waiting in queues after that are dropped. Returns number of dropped
+        tasks and number of tasks which are still running.
+        """
+        deadline = time.time() + timeout
+        self.__lock.acquire()
+        try:
+            while self.waiting() or self.__running():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.__idle.wait(remaining)
+            dropped = self.waiting()
+            for queue in self.__ordered:
+                queue.tasks.clear()
+            return (dropped, self.__running())
+        finally:
+            self.__lock.release()
+
+    def __select(self, free):
+        if free <= 0:
+            return None
+        shortage = sum(map(lambda queue: max(queue.reserved - queue.running, 0),
+                           self.__ordered))
+        for queue in self.__ordered:
+            if not queue.tasks:
+                continue
+            ownShortage = max(queue.reserved - queue.running, 0)
+            if free - (shortage - ownShortage) > 0 or ownShortage:
+                return queue
+        return None
+
+    def __dispatch(self):
+        started = []
+        self.__lock.acquire()
+        try:
+            running = self.__running()
+            while True:
+                queue = self.__select(self.pool.size() - running)
+                if queue is None:
+                    break
+                method, args, callback, partial, submitted = queue.tasks.popleft()
+                queue.running += 1
+                running += 1
+                started.append((queue, method, args, callback, partial, submitted))
+        finally:
+            self.__lock.release()
+        for queue, method, args, callback, partial, submitted in started:
+            self.__start(queue, method, args, callback, partial, submitted)
+
+    def __start(self, queue, method, args, callback, partial, submitted):
+        startTime = time.time()
+        def completed(result):
+            now = time.time()
+            success, value = result
+            self.__lock.acquire()
+            try:
+                queue.running -= 1
+                queue.wait_time = queue.wait_time * 0.8 + (startTime - submitted) * 0.2
+                queue.run_time = queue.run_time * 0.8 + (now - startTime) * 0.2
+                if success:
+                    queue.completed += 1
+                else:
+                    queue.failed += 1
+            finally:
+                self.__lock.release()
+            self.__dispatch()
+            try:
+                if success:
+                    callback(value)
+                else:
+                    log.mpcore.error("Task from queue '%s' failed: %s" % (queue.name, value))
+            finally:
+                self.__idle.acquire()
+                self.__idle.notify_all()
+                self.__idle.release()
+        self.pool.apply_async(_call, (method, args), callback = completed,
+                              submitted = submitted, partial = partial)
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: dependency_resolver
+   :synopsis: Spells dependency graph resolver
+"""
+
+import heapq
+from collections import deque
+
+class DependencyResolver(object):
+    """ Arranges spells in dependency order using explicit dependency graph.
+
+    :param spells: dict which maps spell identifiers to spells
+        (or :class:`agatsuma.spell_descriptor.SpellDescriptor` instances).
+    :param helpers: identifiers of :ref:`dependencies helpers<dependencies-helpers>`
+        created for `provides` groups. Helper is not disconnected when one of
+        providers is disconnected, disconnected provider is removed from
+        helper's dependencies instead.
+
+    Spells which are independent from each other are arranged in order of
+    their identifiers so the result is always the same for the same set
+    of spells.
+    """
+
+    def __init__(self, spells, helpers = ()):
+        self.spells = spells
+        self.helpers = set(helpers)
+        self.disconnected = []
+        self.cycles = []
+
+    @staticmethod
+    def _key(spell_id):
+        return str(spell_id)
+
+    def _sorted(self, ids):
+        return sorted(ids, key = DependencyResolver._key)
+
+    def _disconnect(self):
+        """ Removes spells with non-existent dependencies and all the spells
+        which depend on them (transitively) in one pass.
+        """
+        spells = self.spells
+        dependents = {}
+        queue = deque()
+        for spell_id in self._sorted(spells.keys()):
+            for dep in spells[spell_id].deps():
+                if dep in spells:
+                    dependents.setdefault(dep, []).append(spell_id)
+                elif not spell_id in self.helpers:
+                    queue.append((spell_id, dep))
+        removed = set()
+        while queue:
+            spell_id, dep = queue.popleft()
+            if spell_id in removed:
+                continue
+            removed.add(spell_id)
+            self.disconnected.append((spell_id, dep))
+            for dependent in dependents.get(spell_id, ()):
+                if dependent in self.helpers:
+                    spells[dependent]._remove_dep(spell_id)
+                elif not dependent in removed:
+                    queue.append((dependent, spell_id))
+        return removed
+
+    def _components(self, graph):
+        """ Returns strongly connected components of `graph` (Tarjan's
+        algorithm without recursion)
+        """
+        index = {}
+        lowlink = {}
+        stack = []
+        onStack = set()
+        components = []
+        counter = 0
+        for root in self._sorted(graph.keys()):
+            if root in index:
+                continue
+            work = [(root, iter(self._sorted(graph[root])))]
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            onStack.add(root)
+            while work:
+                node, children = work[-1]
+                advanced = False
+                for child in children:
+                    if not child in index:
+                        index[child] = lowlink[child] = counter
+                        counter += 1
+                        stack.append(child)
+                        onStack.add(child)
+                        work.append((child, iter(self._sorted(graph[child]))))
+                        advanced = True
+                        break
+                    elif child in onStack:
+                        lowlink[node] = min(lowlink[node], index[child])
+                if advanced:
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        onStack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+        return components
+
+    def _cycle_path(self, graph, component):
+        """ Returns exact dependency cycle inside strongly connected
+        `component` starting from its smallest member
+        """
+        members = set(component)
+        start = self._sorted(component)[0]
+        path = [start]
+        visited = {start : 0}
+        node = start
+        while True:
+            node = self._sorted(filter(lambda dep: dep in members, graph[node]))[0]
+            if node in visited:
+                return path[visited[node]:] + [node]
+            visited[node] = len(path)
+            path.append(node)
+
+    def _arrange(self, graph, components, component_of):
+        """ Kahn's algorithm on condensation of `graph`: every strongly
+        connected component is arranged as single node, so spells involved
+        into cycle are registered after all the external dependencies of
+        the whole cycle. Members of component are arranged in order of
+        their identifiers.
+        """
+        indegree = [0] * len(components)
+        dependents = {}
+        for number, component in enumerate(components):
+            depComponents = set()
+            for spell_id in component:
+                depComponents.update(map(lambda dep: component_of[dep], graph[spell_id]))
+            depComponents.discard(number)
+            indegree[number] = len(depComponents)
+            for depComponent in depComponents:
+                dependents.setdefault(depComponent, []).append(number)
+        members = map(self._sorted, components)
+        keyOf = lambda number: DependencyResolver._key(members[number][0])
+        ready = map(lambda number: (keyOf(number), number),
+                    filter(lambda number: indegree[number] == 0, range(len(components))))
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            key, number = heapq.heappop(ready)
+            order.extend(members[number])
+            for dependent in dependents.get(number, ()):
+                indegree[dependent] -= 1
+                if indegree[dependent] == 0:
+                    heapq.heappush(ready, (keyOf(dependent), dependent))
+        return order
+
+    def resolve(self):
+        """ Returns list of spell identifiers in order of registration.
+        Spells with missing dependencies are excluded from the result,
+        they are available via `disconnected` attribute as list of
+        ``(spell_id, missing_dependency)`` tuples. All the found cycles
+        are available via `cycles` attribute as lists of spell identifiers
+        where the last identifier is the same as the first one.
+        """
+        removed = self._disconnect()
+        alive = filter(lambda spell_id: not spell_id in removed, self.spells.keys())
+        graph = dict(map(lambda spell_id: (spell_id, set()), alive))
+        for spell_id in alive:
+            graph[spell_id].update(filter(lambda dep: dep in graph, self.spells[spell_id].deps()))
+
+        components = self._components(graph)
+        component_of = {}
+        for number, component in enumerate(components):
+            for spell_id in component:
+                component_of[spell_id] = number
+            if len(component) > 1 or component[0] in graph[component[0]]:
+                self.cycles.append(self._cycle_path(graph, component))
+        return self._arrange(graph, components, component_of)
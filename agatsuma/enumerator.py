@@ -2,21 +2,66 @@
 
 import sys
 import os
+import time
 import inspect
+import threading
 #import re
 #import traceback
 
 from agatsuma.log import log
 from agatsuma.interfaces import AbstractSpell, IInternalSpell
+from agatsuma.spell_manifest import SpellManifest
+from agatsuma.spell_descriptor import SpellDescriptor
+from agatsuma.dependency_resolver import DependencyResolver
+from agatsuma.startup_profiler import StartupProfiler
 
 def alist_to_strlist(alist):
     return map(lambda atom: str(atom), alist)
 
 class Enumerator(object):
-    def __init__(self, core, app_directorys, forbidden_spells):
+    """Collects spells from spell directories and registers them in core's
+    spellbook in dependency order.
+
+    The following kwargs parameters are supported:
+
+        #. `manifest_path` : path to JSON file used as persistent cache
+           of discovery results (see :class:`agatsuma.spell_manifest.SpellManifest`).
+           Modules which were not changed since the previous run are not
+           scanned and modules without spells are not imported at all.
+        #. `lazy` : when ``True`` spells from unchanged modules known to
+           manifest are registered as
+           :class:`agatsuma.spell_descriptor.SpellDescriptor` placeholders
+           and their modules are imported only when the spellbook is asked
+           for them. Spells are imported for lifecycle callbacks only if they
+           override them, so spells which have no callbacks and are unloaded
+           eagerly or never requested by application are not imported at all.
+           Has no effect without `manifest_path`.
+        #. `import_threads` : size of thread pool used to read files of
+           spell modules and of all the modules they imported on the
+           previous start (remembered in manifest) before importing them,
+           so disk reads are overlapped and imports hit OS page cache.
+           ``0`` (default) disables prefetching. Has no effect without
+           `manifest_path`.
+
+    Modules are imported one by one in order of namespace names: Python
+    holds global import lock while importing, so only file reads may be
+    done concurrently. Import time for every imported spell module is
+    available in `import_timings` dict after :meth:`enumerate_spells`
+    call, time spent for prefetching is available as `prefetch_time`.
+    """
+    def __init__(self, core, app_directorys, forbidden_spells, **kwargs):
         self.app_directorys = app_directorys
         self.forbidden_spells = forbidden_spells
         self.core = core
+        self.manifest = None
+        manifestPath = kwargs.get('manifest_path', None)
+        if manifestPath:
+            self.manifest = SpellManifest(manifestPath)
+        self.lazy = kwargs.get('lazy', False)
+        self.import_threads = kwargs.get('import_threads', 0)
+        self.import_timings = {}
+        self.prefetch_time = 0.0
+        self.profiler = getattr(core, 'profiler', None) or StartupProfiler()
         #def appBaseName(self):
         #  return self.__module__.split('.')[0]
 
@@ -30,7 +75,82 @@ class Enumerator(object):
         #self.core.spells.remove(spell)
         #del self.core.spellbook[spell.spell_id()]
 
+    def __add_spell(self, spells, provides, instance, nsToImport):
+        plid = instance.spell_id()
+        #if not idRe.match(plid):
+        #    raise Exception("Incorrect spell Id: %s" % plid)
+        log.core.info("Spell found: %s; base=%s" % (plid, nsToImport))
+
+        if not spells.has_key(plid):
+            spells[plid] = instance
+            prov = instance.provides()
+            if prov:
+                for provId in prov:
+                    if not provId in provides:
+                        provides[provId] = []
+                    provides[provId].append(plid)
+            #log.core.info("Successfully imported: %s; %s; %s" % (ns, nsName, nsToImport))
+        else:
+            log.core.critical("POSSIBLE CONFLICT: Spell with id '%s' already imported!" % plid)
+
+    @staticmethod
+    def _read_module_files(fileName):
+        # source and bytecode are read for Python modules, extension
+        # modules are read as is
+        base, ext = os.path.splitext(fileName)
+        if ext in ('.py', '.pyc', '.pyo'):
+            paths = (base + '.py', base + '.pyc')
+        else:
+            paths = (fileName, )
+        size = 0
+        for path in paths:
+            try:
+                f = open(path, 'rb')
+                try:
+                    chunk = f.read(1 << 20)
+                    while chunk:
+                        size += len(chunk)
+                        chunk = f.read(1 << 20)
+                finally:
+                    f.close()
+            except IOError:
+                pass
+        return size
+
+    def __prefetch_modules(self, fileNames):
+        started = time.time()
+        pending = list(reversed(fileNames))
+        sizes = []
+        def reader():
+            # list.pop() and list.append() are atomic
+            while True:
+                try:
+                    fileName = pending.pop()
+                except IndexError:
+                    return
+                sizes.append(Enumerator._read_module_files(fileName))
+        threads = map(lambda i: threading.Thread(target = reader, name = "SpellPrefetch-%d" % i),
+                      range(min(self.import_threads, len(fileNames))))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.prefetch_time = time.time() - started
+        log.core.debug('Prefetched %d module files (%d KB) using %d threads in %.3fs' %
+                       (len(fileNames), sum(sizes) / 1024, len(threads), self.prefetch_time))
+
+    @staticmethod
+    def _loaded_files(namespaces):
+        files = map(lambda name: getattr(sys.modules.get(name, None), '__file__', None),
+                    namespaces)
+        return sorted(set(filter(None, files)))
+
     def enumerate_spells(self, essentialSpellSpaces, additionalSpellPaths):
+        with self.profiler.phase("spells_enumeration"):
+            self.__enumerate_spells(essentialSpellSpaces, additionalSpellPaths)
+
+    def __enumerate_spells(self, essentialSpellSpaces, additionalSpellPaths):
         spell_directories = []
         spell_directories.extend(additionalSpellPaths)
 
@@ -60,6 +180,7 @@ class Enumerator(object):
 
         namespacesToImport = []
         namespacesToImport.extend(essentialSpellSpaces)
+        moduleFiles = {}
 
         for spellsDir in spell_directories:
             #spellsDir =  #os.path.realpath(os.path.join(self.OPT.appPath, 'controllers'))
@@ -82,63 +203,104 @@ class Enumerator(object):
                     return True
                 fileList = filter(lambda x: x.endswith('.py') and not x.startswith('__'), files)
                 fileList = filter(useFilePred, fileList)
-                fileList = map(lambda x: os.path.join(root, x), fileList)
-                fileList = map(lambda x: os.path.splitext(x)[0], fileList)
-                fileList = map(lambda x: x.replace(spellsDir + os.path.sep, ''), fileList)
-                fileList = map(lambda x: x.replace(os.path.sep, '.'), fileList)
-                fileList = map(lambda x: "%s.%s" % (basicNamespace, x), fileList)
-                namespacesToImport.extend(fileList)
+                for fileName in map(lambda x: os.path.join(root, x), fileList):
+                    nsName = os.path.splitext(fileName)[0]
+                    nsName = nsName.replace(spellsDir + os.path.sep, '')
+                    nsName = nsName.replace(os.path.sep, '.')
+                    nsName = "%s.%s" % (basicNamespace, nsName)
+                    moduleFiles[nsName] = (fileName, spellsDir)
+                    namespacesToImport.append(nsName)
         #idRe = re.compile('^[\w]+$')
         spells = {}
         provides = {}
-        namespacesToImport = list(set(namespacesToImport))
+        namespacesToImport = sorted(set(namespacesToImport))
         log.core.debug('Collected namespaces: %s' % str(namespacesToImport))
         log.core.info('Started spells enumerator...')
+        plan = []
         for nsToImport in namespacesToImport:
             if not nsToImport in self.forbidden_spells:
-                #log.core.info('trying %s...' % nsToImport)
+                fileName, spellsDir = moduleFiles.get(nsToImport, (None, None))
+                cached = None
+                if self.manifest and fileName:
+                    cached = self.manifest.lookup(fileName, nsToImport)
+                    if cached == []:
+                        log.core.debug('Not a spellspace (according to manifest): %s' % nsToImport)
+                        continue
+                    if cached and self.lazy:
+                        nsFile = fileName.replace(spellsDir + os.path.sep, '')
+                        for descr in cached:
+                            self.__add_spell(spells, provides,
+                                             SpellDescriptor(nsToImport, nsFile, descr),
+                                             nsToImport)
+                        continue
+                plan.append((nsToImport, fileName, spellsDir, cached))
+            else:
+                log.core.warning('Namespace ignored due app settings: %s' % nsToImport)
+
+        if self.manifest and self.import_threads > 0:
+            fileNames = set()
+            for nsToImport, fileName, spellsDir, cached in plan:
+                if fileName:
+                    fileNames.add(fileName)
+                    fileNames.update(self.manifest.imports(fileName))
+            with self.profiler.phase("prefetch"):
+                self.__prefetch_modules(sorted(fileNames))
+
+        for nsToImport, fileName, spellsDir, cached in plan:
+            #log.core.info('trying %s...' % nsToImport)
+            mod = None
+            loadedBefore = set(sys.modules)
+            started = time.time()
+            try:
+                mod = __import__(nsToImport, {}, {}, '*', -1)
+            except Exception, e:
+                log.core.warning('Exception while importing %s: %s' % (nsToImport, str(e)))
+                #traceback.print_exc()
                 mod = None
-                try:
-                    mod = __import__(nsToImport, {}, {}, '*', -1)
-                except Exception, e:
-                    log.core.warning('Exception while importing %s: %s' % (nsToImport, str(e)))
-                    #traceback.print_exc()
-                    mod = None
+            self.import_timings[nsToImport] = time.time() - started
+            loaded = set(sys.modules) - loadedBefore
+            loaded.discard(nsToImport)
 
-                possibleSpells = []
+            possibleSpells = None
+            if cached and mod:
+                possibleSpells = map(lambda descr: getattr(mod, descr["class"], None), cached)
+                if None in possibleSpells:
+                    possibleSpells = None
+            if possibleSpells is None:
                 plPredicate = lambda x: type(x) == type and issubclass(x, AbstractSpell) and x != AbstractSpell
-                possibleSpells = inspect.getmembers(mod, plPredicate)
-                if possibleSpells:
-                    possibleSpells = map(lambda x: x[1], possibleSpells)
-                    for possibleSpell in possibleSpells:
-                        instance = possibleSpell()
-                        plid = instance.spell_id()
-                        #if not idRe.match(plid):
-                        #    raise Exception("Incorrect spell Id: %s" % plid)
-                        log.core.info("Spell found: %s; base=%s" % (plid, nsToImport))
-
-                        if not spells.has_key(plid):
-                            nsName = mod.__name__
-                            ns = mod #__import__(nsName, stateVars, {}, '*', -1)
-                            instance._set_details(
-                                namespace = ns,
-                                namespace_name = nsName,
-                                file_name = ns.__file__.replace(spellsDir + os.path.sep, '')
-                            )
-                            spells[plid] = instance
-                            prov = instance.provides()
-                            if prov:
-                                for provId in prov:
-                                    if not provId in provides:
-                                        provides[provId] = []
-                                    provides[provId].append(plid)
-                            #log.core.info("Successfully imported: %s; %s; %s" % (ns, nsName, nsToImport))
-                        else:
-                            log.core.critical("POSSIBLE CONFLICT: Spell with id '%s' already imported!" % plid)
-                else:
-                    log.core.info('Not a spellspace: %s' % nsToImport)
+                possibleSpells = map(lambda x: x[1], inspect.getmembers(mod, plPredicate))
+                cached = None
+            instances = map(lambda possibleSpell: possibleSpell(), possibleSpells)
+            if self.manifest and fileName and mod:
+                if cached is None:
+                    self.manifest.update(fileName, nsToImport, instances)
+                self.manifest.remember_imports(fileName, Enumerator._loaded_files(loaded))
+
+            if instances:
+                for instance in instances:
+                    nsFile = mod.__file__
+                    if spellsDir:
+                        nsFile = nsFile.replace(spellsDir + os.path.sep, '')
+                    instance._set_details(
+                        namespace = mod,
+                        namespace_name = mod.__name__,
+                        file_name = nsFile
+                    )
+                    self.__add_spell(spells, provides, instance, nsToImport)
             else:
-                log.core.warning('Namespace ignored due app settings: %s' % nsToImport)
+                log.core.info('Not a spellspace: %s' % nsToImport)
+
+        slowest = sorted(self.import_timings.items(), key = lambda item: item[1], reverse = True)
+        log.core.debug('Slowest spell imports: %s' %
+                       ', '.join(map(lambda item: '%s (%.3fs)' % item, slowest[:5])))
+        self.profiler.record_imports(self.import_timings)
+
+        if self.manifest:
+            self.manifest.forget_except(set(map(lambda x: x[0], moduleFiles.values())))
+            try:
+                self.manifest.save()
+            except (IOError, OSError), e:
+                log.core.warning('Spells manifest was not saved: %s' % str(e))
 
         falseSpells = []
         for provId in provides:
@@ -158,50 +320,16 @@ class Enumerator(object):
         self.print_spells_list(spellsList)
 
         log.core.info('RESOLVING DEPENDENCIES...')
-        needCheck = True
-        while needCheck:
-            needCheck = False
-            for id in spells.keys():
-                deps = spells[id].deps()
-                if deps:
-                    for dep in deps:
-                        if not dep in spells:
-                            log.core.warning('[WARNING] Disconnected: "%s"; non-existent dependence: "%s"' % (id, dep))
-                            for falseSpell in falseSpells:
-                                falseSpell._remove_dep(id)
-                            del spells[id]
-                            needCheck = True
-                            break
+        resolver = DependencyResolver(spells, map(lambda spell: spell.spell_id(), falseSpells))
+        resolved = resolver.resolve()
+        for id, dep in resolver.disconnected:
+            log.core.warning('[WARNING] Disconnected: "%s"; non-existent dependence: "%s"' % (id, dep))
+        for cycle in resolver.cycles:
+            log.core.warning('[WARNING] Dependency cycle: %s' % ' -> '.join(alist_to_strlist(cycle)))
 
         log.core.info('Arranging spells...')
-        resolved = []
-        needIteration = True
-        while needIteration:
-            needIteration = False
-            for id in spells.keys():
-                deps = spells[id].deps()
-
-                ok = True
-                if deps:
-                    for dep in deps:
-                        ok = ok and dep in resolved
-
-                if ok:
-                    #if not deps:
-                    #    log.core.info('No dependencies for "%s"; adding as %d' % (id, len(self.spells)))
-                    #else:
-                    #    log.core.info('Already resolved dependencies for "%s"; adding as %d' % (id, len(self.spells)))
-                    self.__register_spell(spells[id])
-                    resolved.append(id)
-                    del spells[id]
-                    needIteration = True
-                    break
-            #log.core.info('new iteration, already resolved: %s' % resolved)
-
-        cyclicDeps = sorted(spells.values(), lambda a, b: cmp(len(a.deps()), len(b.deps())))
-        for spell in cyclicDeps:
-            log.core.warning('[WARNING] Adding loop-dependant spell "%s" (deps: %s)' % (spell.spell_id(), str(spell.deps())))
-            self.__register_spell(spell)
+        for id in resolved:
+            self.__register_spell(spells[id])
 
         spellsNames = self.core.spellbook.all_names() # map(lambda p: p.spell_id(), self.core.spells)
         log.core.debug("Connected %d spells: %s. False spells will be removed now" % (len(spellsNames), str(spellsNames)))
@@ -215,11 +343,12 @@ class Enumerator(object):
 
     def eagerUnload(self):
         log.core.debug("Performing eager unload...")
-        toUnload = filter(lambda spell: spell.config.get('eager_unload', None),
-                          self.core.spellbook.to_list())
-        for spell in toUnload:
-            log.core.debug('Eager unloading "%s"' % spell.spell_id())
-            self.__unregister_spell(spell)
+        with self.profiler.phase("eager_unload"):
+            toUnload = filter(lambda spell: spell.config.get('eager_unload', None),
+                              self.core.spellbook.entries())
+            for spell in toUnload:
+                log.core.debug('Eager unloading "%s"' % spell.spell_id())
+                self.__unregister_spell(spell)
 
     def print_spells_list(self, spells):
         for spell in spells:
@@ -28,6 +28,11 @@ The following spell parameters are supported now:
        application initialization, such as settings registering
        and data preparation. Also it may be suitable for
        :ref:`dependencies helpers<dependencies-helpers>`.
+    #. `settings_groups` : tuple of settings groups names which
+       changes are interesting for this spell. Spell's
+       :meth:`agatsuma.interfaces.AbstractSpell.post_config_update`
+       is called only when options in these groups are changed.
+       By default spell is notified about all the changes.
     """
 
     def __init__(self, spell_id, spellConfig = {}):
@@ -112,10 +117,18 @@ The following spell parameters are supported now:
         """
         pass
 
+    def settings_groups(self):
+        """ Returns tuple of settings groups names this spell should be
+        notified about or ``None`` for all the groups
+        (see `spellConfig` constructor parameter).
+        """
+        return self.config.get('settings_groups', None)
+
     def post_config_update(self, **kwargs):
         """ Settings service calls this method when any writable setting is
         updated. This method may be used to send updated data to worker
-        processes for example.
+        processes for example. `changed` kwarg contains set of names
+        (``group.option``) of changed settings.
 
         *Should be overriden in subclasses*
         """
@@ -26,3 +26,22 @@ class IPoolEventSpell(object):
         that should be unique for main process.
         """
         pass
+
+    def on_worker_spawn(self, core, pid):
+        """ Multiprocessing core calls this method in main process when
+        worker process with `pid` is started, including initial workers
+        and workers started when pool grows
+        (see ``mpcore.max_workers`` option).
+
+        This method is called from pool's internal thread.
+        """
+        pass
+
+    def on_worker_retire(self, core, pid):
+        """ Multiprocessing core calls this method in main process when
+        idle worker process with `pid` exits due pool shrinking
+        (see ``mpcore.worker_idle_timeout`` option).
+
+        This method is called from pool's internal thread.
+        """
+        pass
@@ -5,4 +5,27 @@ class AbstractSettingsBackend(object):
       return currentValue
      
     def save(self, name, value):
-        pass
\ No newline at end of file
+        pass
+
+    def get_many(self, currentValues):
+        """ Bulk version of :meth:`get`. Receives dict which maps setting
+        names to current values and returns dict with the same keys and
+        values from storage (or current values for settings not found
+        in storage).
+
+        Default implementation calls :meth:`get` for every setting, so
+        backends should override it if storage supports bulk reads.
+        """
+        result = {}
+        for name, currentValue in currentValues.items():
+            result[name] = self.get(name, currentValue)
+        return result
+
+    def save_many(self, values):
+        """ Bulk version of :meth:`save`. Receives dict which maps setting
+        names to values.
+
+        Default implementation calls :meth:`save` for every setting.
+        """
+        for name, value in values.items():
+            self.save(name, value)
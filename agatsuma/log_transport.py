@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: log_transport
+   :synopsis: Compact binary log events transport between processes
+"""
+
+import os
+import time
+import struct
+import marshal
+import logging
+import threading
+import multiprocessing
+from multiprocessing.util import register_after_fork
+
+from agatsuma.mp_log_handler import MPLogHandler
+
+FRAME_NAME = 1
+FRAME_EVENT = 2
+FRAME_STOP = 3
+
+# body length, frame type
+_frameHeader = struct.Struct("<IB")
+# pid, logger id
+_nameHeader = struct.Struct("<IH")
+# pid, logger id, level, created, line number
+_eventHeader = struct.Struct("<IHBdi")
+
+# marshal writes any object supporting buffer interface (unicode and str
+# subclasses, bytearray, etc.) as plain string, so only exact builtin
+# types may be marshalled
+_scalarTypes = frozenset([str, unicode, int, long, float, bool, type(None)])
+
+def _marshallable(value):
+    """ Returns ``True`` if marshal restores `value` exactly """
+    valueType = type(value)
+    if valueType in _scalarTypes:
+        return True
+    elif valueType is dict:
+        for key, item in value.iteritems():
+            if not _marshallable(key) or not _marshallable(item):
+                return False
+        return True
+    elif valueType is list or valueType is tuple:
+        for item in value:
+            if not _marshallable(item):
+                return False
+        return True
+    return False
+
+def _text(value):
+    """ Converts subclasses of strings (and other objects) to exact
+    ``str`` or ``unicode`` """
+    if value is None or type(value) in (str, unicode):
+        return value
+    if isinstance(value, unicode):
+        return unicode(value)
+    return str(value)
+
+class LogEventWriter(object):
+    """ Encodes log records into frames and writes them to file descriptor
+    `fd` (pipe or Unix socket shared by many processes).
+
+    Every frame is prefixed with body length and frame type. Logger names
+    are sent once per process in ``FRAME_NAME`` frames, events refer to
+    them by number. Event contains pid, logger number, level, timestamp,
+    line number and marshalled tuple of message template, arguments,
+    traceback text, function name, path and thread name. Message is
+    rendered in writing process only when message or its arguments
+    aren't exact builtin types (marshal would silently turn subclasses of
+    strings and other buffer objects into plain strings).
+
+    :param lock: lock shared by all the writers, frames written under lock
+        are never interleaved with frames of another processes.
+    """
+
+    def __init__(self, fd, lock):
+        self.fd = fd
+        self.lock = lock
+        self.__pid = None
+        # guards interned names, records may be encoded by flusher thread
+        # and by explicit flush() concurrently
+        self._encoding = threading.Lock()
+        register_after_fork(self, LogEventWriter._after_fork)
+
+    def _after_fork(self):
+        # lock might be held by another thread of parent process
+        self._encoding = threading.Lock()
+
+    def __intern(self, name, frames):
+        loggerId = self.__ids.get(name, None)
+        if loggerId is None:
+            loggerId = len(self.__ids)
+            self.__ids[name] = loggerId
+            body = _nameHeader.pack(self.__pid, loggerId) + name.encode('utf-8')
+            frames.append(_frameHeader.pack(len(body), FRAME_NAME) + body)
+        return loggerId
+
+    def _encode(self, record, frames):
+        if self.__pid != os.getpid():
+            # ids are interned per process
+            self.__pid = os.getpid()
+            self.__ids = {}
+        loggerId = self.__intern(record.name, frames)
+        details = (record.msg, record.args, record.exc_text,
+                   record.funcName, record.pathname, record.threadName)
+        if not _marshallable(details):
+            details = tuple(map(_text, (record.getMessage(), None) + details[2:]))
+        payload = marshal.dumps(details)
+        body = _eventHeader.pack(self.__pid, loggerId, record.levelno,
+                                 record.created, record.lineno) + payload
+        frames.append(_frameHeader.pack(len(body), FRAME_EVENT) + body)
+
+    def encode(self, records):
+        """ Returns list of frames for `records` """
+        frames = []
+        self._encoding.acquire()
+        try:
+            for record in records:
+                self._encode(record, frames)
+        finally:
+            self._encoding.release()
+        return frames
+
+    def write(self, records):
+        self.__write("".join(self.encode(records)))
+
+    def write_stop(self):
+        """ Makes reader of this pipe stop (see :meth:`LogEventReader.read`) """
+        self.__write(_frameHeader.pack(0, FRAME_STOP))
+
+    def __write(self, data):
+        self.lock.acquire()
+        try:
+            while data:
+                written = os.write(self.fd, data)
+                data = data[written:]
+        finally:
+            self.lock.release()
+
+class LogEventReader(object):
+    """ Reads frames written by :class:`LogEventWriter` from file
+    descriptor `fd` and restores log records """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.names = {}
+        self.__buffer = ""
+
+    def __read(self, size):
+        while len(self.__buffer) < size:
+            chunk = os.read(self.fd, max(65536, size - len(self.__buffer)))
+            if not chunk:
+                raise EOFError()
+            self.__buffer += chunk
+        data = self.__buffer[:size]
+        self.__buffer = self.__buffer[size:]
+        return data
+
+    def decode(self, frameType, body):
+        if frameType == FRAME_NAME:
+            pid, loggerId = _nameHeader.unpack_from(body)
+            self.names[(pid, loggerId)] = body[_nameHeader.size:].decode('utf-8')
+            return None
+        pid, loggerId, level, created, lineno = _eventHeader.unpack_from(body)
+        msg, args, excText, funcName, pathname, threadName = marshal.loads(body[_eventHeader.size:])
+        record = logging.LogRecord(self.names.get((pid, loggerId), "unknown"),
+                                   level, pathname, lineno, msg, args, None, funcName)
+        record.created = created
+        record.msecs = (created - long(created)) * 1000
+        record.relativeCreated = (created - logging._startTime) * 1000
+        record.process = pid
+        record.threadName = threadName
+        record.exc_text = excText
+        return record
+
+    def read(self):
+        """ Returns the next log record or ``None`` when stop frame is
+        received. Raises ``EOFError`` when all the writers are closed """
+        while True:
+            length, frameType = _frameHeader.unpack(self.__read(_frameHeader.size))
+            if frameType == FRAME_STOP:
+                return None
+            record = self.decode(frameType, self.__read(length))
+            if record:
+                return record
+
+class FramedLogHandler(MPLogHandler):
+    """ :class:`agatsuma.mp_log_handler.MPLogHandler` which sends buffered
+    records with :class:`LogEventWriter` instead of pickling them into
+    multiprocessing queue """
+
+    def __init__(self, writer, handler, **kwargs):
+        MPLogHandler.__init__(self, handler, **kwargs)
+        self.writer = writer
+
+    def send(self, records):
+        self.writer.write(records)
+
+class FramedLogCollector(object):
+    """ Thread in main process which reads records with
+    :class:`LogEventReader` and passes them to `handler`. Collector is
+    stopped with stop frame sent by `writer` of main process, because
+    pipe is never closed while worker processes hold its writing end.
+    """
+
+    def __init__(self, reader, handler, writer):
+        self.reader = reader
+        self.handler = handler
+        self.writer = writer
+        self.__thread = threading.Thread(target = self.__collect, name = "LogCollector")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __collect(self):
+        while True:
+            try:
+                record = self.reader.read()
+            except (EOFError, OSError):
+                break
+            if record is None:
+                break
+            self.handler.handle(record)
+
+    def stop(self, timeout = 5):
+        """ Stops collector after all the records written before """
+        self.writer.write_stop()
+        self.__thread.join(timeout)
+
+def log_pipe():
+    """ Creates pipe and returns tuple (writer, reader). Must be called
+    before forking of processes which will log """
+    readFd, writeFd = os.pipe()
+    return (LogEventWriter(writeFd, multiprocessing.Lock()), LogEventReader(readFd))
+
+if __name__ == "__main__":
+    # Compares framed transport with pickling of records into queue
+    import cPickle
+    def makeRecords(count):
+        records = []
+        for i in xrange(count):
+            record = logging.LogRecord("agatsuma.sessions", logging.INFO, __file__, i,
+                                       "Session %s with data %s saved, %d bytes",
+                                       ("f00d%08d" % i, {"user" : u"user%d" % i, "visits" : i}, i * 10),
+                                       None, "save")
+            records.append(record)
+        return records
+    count = 20000
+    records = makeRecords(count)
+
+    started = time.time()
+    pickled = map(lambda record: cPickle.dumps(record, cPickle.HIGHEST_PROTOCOL), records)
+    restored = map(cPickle.loads, pickled)
+    pickleTime = time.time() - started
+    pickleSize = sum(map(len, pickled))
+
+    writer = LogEventWriter(None, None)
+    reader = LogEventReader(None)
+    started = time.time()
+    frames = writer.encode(records)
+    restored = []
+    for frame in frames:
+        length, frameType = _frameHeader.unpack_from(frame)
+        record = reader.decode(frameType, frame[_frameHeader.size:])
+        if record:
+            restored.append(record)
+    framedTime = time.time() - started
+    framedSize = sum(map(len, frames))
+    assert restored[-1].getMessage() == records[-1].getMessage()
+
+    print "%d records" % count
+    print "pickle: %8d bytes %7.1f bytes/record %.3fs" % (pickleSize, float(pickleSize) / count, pickleTime)
+    print "framed: %8d bytes %7.1f bytes/record %.3fs" % (framedSize, float(framedSize) / count, framedTime)
@@ -1,8 +1,76 @@
 # -*- coding: utf-8 -*-
 
+import sys
 import logging
 import multiprocessing
 
+class LevelCheckedLogger(object):
+    '''
+    Wrapper of logging.Logger which checks level before anything else.
+    Calls for disabled levels return immediately without creation of
+    LogRecord and without formatting of message, so messages should be
+    passed with arguments (log.core.debug("Spell %s", spellId)) instead of
+    preformatted strings.
+    Level is checked by logger's isEnabledFor() on every call, so changes
+    of levels made by any means (setLevel, logging.disable, logging.config)
+    take effect immediately.
+    '''
+    __slots__ = ("logger", )
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def isEnabledFor(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def _emit(self, level, msg, args, exc_info = None, extra = None):
+        # caller of debug(), info(), etc.
+        frame = sys._getframe(2)
+        if exc_info and not isinstance(exc_info, tuple):
+            exc_info = sys.exc_info()
+        record = self.logger.makeRecord(self.logger.name, level,
+                                        frame.f_code.co_filename, frame.f_lineno,
+                                        msg, args, exc_info,
+                                        frame.f_code.co_name, extra)
+        self.logger.handle(record)
+
+    def log(self, level, msg, *args, **kwargs):
+        if self.logger.isEnabledFor(level):
+            self._emit(level, msg, args, **kwargs)
+
+    def debug(self, msg, *args, **kwargs):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self._emit(logging.DEBUG, msg, args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        if self.logger.isEnabledFor(logging.INFO):
+            self._emit(logging.INFO, msg, args, **kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        if self.logger.isEnabledFor(logging.WARNING):
+            self._emit(logging.WARNING, msg, args, **kwargs)
+
+    warn = warning
+
+    def error(self, msg, *args, **kwargs):
+        if self.logger.isEnabledFor(logging.ERROR):
+            self._emit(logging.ERROR, msg, args, **kwargs)
+
+    def exception(self, msg, *args, **kwargs):
+        kwargs['exc_info'] = 1
+        if self.logger.isEnabledFor(logging.ERROR):
+            self._emit(logging.ERROR, msg, args, **kwargs)
+
+    def critical(self, msg, *args, **kwargs):
+        if self.logger.isEnabledFor(logging.CRITICAL):
+            self._emit(logging.CRITICAL, msg, args, **kwargs)
+
+    fatal = critical
+
+    def __getattr__(self, name):
+        # handlers, filters, etc.
+        return getattr(self.logger, name)
+
 class LoggingSystem(object):
     '''
     Logging sub-system. Just wrapper of python.logging with some start-up configuration.
@@ -10,6 +78,7 @@ class LoggingSystem(object):
     loggersNeedUpdate = {} # TODO: i don't know why it needs. Need to file all occurs and review
 
     instance = None
+    loggers = {}
     
     def __new__(cls, *a, **kva):
         '''
@@ -66,15 +135,19 @@ class LoggingSystem(object):
     
     def get_logger(self, name):
         '''
-        Just wrapper for future hooks
+        Returns LevelCheckedLogger wrapping logger with given name
         @param name: name of logger
         @return: logger
         '''
-        return logging.getLogger(name)
-    
+        logger = LoggingSystem.loggers.get(name, None)
+        if logger is None:
+            logger = LevelCheckedLogger(logging.getLogger(name))
+            LoggingSystem.loggers[name] = logger
+        return logger
+
     def configure(self, config):
         '''
         Configure loggers by configuration dictionary
         @param config: dict of logger configuration (see http://docs.python.org/library/logging.html#logging.dictConfig)
         '''
-        raise Exception("Not implemented yet")
\ No newline at end of file
+        raise Exception("Not implemented yet")
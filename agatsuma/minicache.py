@@ -88,3 +88,45 @@ def EternalInvariant(function):
     def wrapper(*args, **kwargs):
         return clos(*args, **kwargs)
     return wrapper
+
+class GenerationalInvariantHelper(object):
+    """Decorator intended to speed-up functions which results depend
+    only on args and on some external state with generation counter
+    (function returns same result while generation is the same).
+    Every cached result is stored together with generation it was
+    computed for and recomputed when generation changes.
+
+    Lookups don't take any locks: cache entries are immutable tuples
+    and dict operations are atomic, so the worst case is computing
+    the same result twice in concurrent threads.
+    """
+
+    def __init__(self, fn, generation):
+        self._fn = fn
+        self._generation = generation
+        self._cache = {}
+
+    def __call__(self, *args, **kwargs):
+        generation = self._generation()
+        entry = self._cache.get(args, None)
+        if entry is not None and entry[0] == generation:
+            return entry[1]
+        result = self._fn(*args, **kwargs)
+        # generation is taken before computing, so result computed during
+        # concurrent change will be revalidated on the next call
+        self._cache[args] = (generation, result)
+        return result
+
+    def cleanup(self):
+        self._cache = {}
+
+def GenerationalInvariant(generation):
+    """`generation` is a function without arguments returning current
+    generation of state wrapped function depends on.
+    """
+    def decorator(function):
+        clos = GenerationalInvariantHelper(function, generation)
+        def wrapper(*args, **kwargs):
+            return clos(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,29 +1,141 @@
+import os
 import logging
+import threading
+from collections import deque
+from multiprocessing.util import Finalize, register_after_fork
+
+from agatsuma.errors import EAbstractFunctionCall
 
 class MPLogHandler(logging.Handler):
-    def __init__(self, queue, handler):
+    """ Base class of handlers which ship log records to main process.
+    Subclasses implement :meth:`send` (see
+    :class:`agatsuma.log_transport.FramedLogHandler`).
+
+    Records are buffered and sent as lists by background thread when
+    `batch_size` records are collected or `flush_interval` seconds passed,
+    so :meth:`emit` never waits for IPC. Buffer holds at most `capacity`
+    records, the oldest records are dropped when it's full. Number of
+    dropped records is available as `dropped` attribute and it's reported
+    with the next batch.
+    """
+    def __init__(self, handler, batch_size = 100, flush_interval = 0.5, capacity = 10000):
         logging.Handler.__init__(self)
-        self.queue = queue
         self.realHandler = handler
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.capacity = capacity
+        self.dropped = 0
+        self.__pid = None
+        self.__init_lock = threading.Lock()
+        # lock may be held by another thread of parent process during fork
+        register_after_fork(self, MPLogHandler.__reset_init_lock)
+
+    def __reset_init_lock(self):
+        self.__init_lock = threading.Lock()
 
     def setFormatter(self, fmt):
         logging.Handler.setFormatter(self, fmt)
         self.realHandler.setFormatter(fmt)
 
     def _format_record(self, record):
+        # message itself is formatted by real handler in main process,
+        # only traceback must be rendered here
         ei = record.exc_info
         if ei:
-            dummy = self.format(record) # just to get traceback text into record.exc_text
+            if not record.exc_text:
+                record.exc_text = (self.formatter or logging._defaultFormatter).formatException(ei)
             record.exc_info = None  # to avoid Unpickleable error
         return record
 
-    def send(self, s):
-        self.queue.put(s)
+    def __start_flusher(self):
+        # buffer, lock and thread are not usable after fork
+        self.__buffer = deque(maxlen = self.capacity)
+        self.__reported = 0
+        self.__ready = threading.Condition(threading.Lock())
+        self.__stopped = False
+        # other threads skip initialization after this point
+        self.__pid = os.getpid()
+        self.__flusher = threading.Thread(target = self.__flush_periodically, name = "LogFlusher")
+        self.__flusher.daemon = True
+        self.__flusher.start()
+        # pool workers run finalizers before exit
+        Finalize(self, self.close, exitpriority = 10)
+
+    def __take_batch(self):
+        batch = list(self.__buffer)
+        self.__buffer.clear()
+        if self.dropped > self.__reported:
+            lost = self.dropped - self.__reported
+            self.__reported = self.dropped
+            batch.insert(0, logging.LogRecord("logging", logging.WARNING, __file__, 0,
+                                              "%d log records dropped in process %d due buffer overflow",
+                                              (lost, self.__pid), None))
+        return batch
+
+    def __flush_periodically(self):
+        while not self.__stopped:
+            self.__ready.acquire()
+            try:
+                if len(self.__buffer) < self.batch_size:
+                    self.__ready.wait(self.flush_interval)
+                batch = self.__take_batch()
+            finally:
+                self.__ready.release()
+            if batch:
+                self.__send_batch(batch)
+
+    def __send_batch(self, batch):
+        try:
+            self.send(batch)
+        except Exception:
+            self.__ready.acquire()
+            self.dropped += len(batch)
+            self.__ready.release()
+
+    def flush(self):
+        if self.__pid != os.getpid():
+            return
+        self.__ready.acquire()
+        try:
+            batch = self.__take_batch()
+        finally:
+            self.__ready.release()
+        if batch:
+            self.__send_batch(batch)
+
+    def close(self):
+        if self.__pid == os.getpid() and not self.__stopped:
+            self.__ready.acquire()
+            self.__stopped = True
+            self.__ready.notify()
+            self.__ready.release()
+            self.__flusher.join(self.flush_interval * 2)
+            self.flush()
+        logging.Handler.close(self)
+
+    def send(self, records):
+        """ Sends list of records to main process """
+        raise EAbstractFunctionCall()
 
     def emit(self, record):
         try:
+            if self.__pid != os.getpid():
+                self.__init_lock.acquire()
+                try:
+                    if self.__pid != os.getpid():
+                        self.__start_flusher()
+                finally:
+                    self.__init_lock.release()
             s = self._format_record(record)
-            self.send(s)
+            self.__ready.acquire()
+            try:
+                if len(self.__buffer) == self.capacity:
+                    self.dropped += 1
+                self.__buffer.append(s)
+                if len(self.__buffer) >= self.batch_size:
+                    self.__ready.notify()
+            finally:
+                self.__ready.release()
         #except (KeyboardInterrupt, SystemExit): # is it needed ?
         #    raise
         except:
@@ -10,41 +10,104 @@ import threading
 from agatsuma import log
 from agatsuma.interfaces import AbstractSpell
 
-class DictAccessProxy(object):
-    def __init__(self, groupName, sourceDict, roList, types, comments):
-        object.__setattr__(self, '_DictAccessProxy__dict', sourceDict)
-        self.__roList = roList
-        self.__groupName = groupName
-        self.__types = types
-        self.__comments = comments
-
-    def __getattr__(self, name):
-        storedDict = object.__getattribute__(self, '_DictAccessProxy__dict')
-        if name in storedDict:
-            return storedDict[name]
-        else:
-            return object.__getattribute__(self, name)
+class SettingsGroup(object):
+    """ Base class for compiled settings groups. Class with ``__slots__``
+    is generated for every group when settings are loaded (see
+    :func:`compile_group`), so reading of an option is usual attribute
+    access. Group instances are immutable: assignment creates
+    new config data and installs it with :meth:`Settings.set_config_data`.
+    """
+    __slots__ = ()
 
     def __setattr__(self, name, value):
-        if name in self.__dict:
-            if name in self.__roList:
-                raise Exception("Option '%s.%s' is read-only" % (self.__groupName, name))
-            elif type(value) != self.__types[name]:
-                raise Exception("Option '%s.%s' must have type %s, but %s tried to assign" %
-                                (self.__groupName,
-                                 name,
-                                 self.__types[name],
-                                 type(value),
-                                )
-                               )
-            else:
-                self.__dict[name] = value
-                Settings.set_config_data(Settings.settings)
+        cls = type(self)
+        if not name in cls._options:
+            raise AttributeError("Option '%s.%s' is not registered" % (cls._group_name, name))
+        if name in cls._readonly:
+            raise Exception("Option '%s.%s' is read-only" % (cls._group_name, name))
+        elif type(value) != cls._types[name]:
+            raise Exception("Option '%s.%s' must have type %s, but %s tried to assign" %
+                            (cls._group_name,
+                             name,
+                             cls._types[name],
+                             type(value),
+                            )
+                           )
         else:
-            object.__setattr__(self, name, value)
+            Settings.set_config_data({cls._group_name : {name : value}})
+
+    def __delattr__(self, name):
+        raise Exception("It's not allowed to remove settings")
 
     def __repr__(self):
-        return str("<Settings group: %s>" % self.__dict)
+        cls = type(self)
+        values = dict(map(lambda name: (name, getattr(self, name)), cls.__slots__))
+        return str("<Settings group: %s>" % values)
+
+def str_keys(objdict):
+    """ JSON object hook making keys of decoded dicts ``str``: group and
+    option names are used as names of classes and slots """
+    result = {}
+    for item in objdict.iteritems():
+        result[str(item[0])] = item[1]
+    return result
+
+def compile_group(groupName, options, roList, types, comments):
+    """ Returns :class:`SettingsGroup` subclass with slots for all the
+    `options` of group `groupName`
+    """
+    return type("SettingsGroup_%s" % groupName,
+                (SettingsGroup, ),
+                {"__slots__" : tuple(options),
+                 "_group_name" : groupName,
+                 "_options" : frozenset(options),
+                 "_readonly" : frozenset(roList),
+                 "_types" : types,
+                 "_comments" : comments,
+                })
+
+def compile_unregistered_group(groupName, values, groupClass = None):
+    """ Compiles group containing options which were not registered.
+    Types of such options are taken from their current `values`,
+    registered options of `groupClass` (if any) keep their types,
+    comments and read-only flags.
+    """
+    types = dict(map(lambda item: (item[0], type(item[1])), values.items()))
+    roList = ()
+    comments = {}
+    if groupClass:
+        types.update(groupClass._types)
+        roList = groupClass._readonly
+        comments = groupClass._comments
+    return compile_group(groupName, values.keys(), roList, types, comments)
+
+def instantiate_group(groupClass, values):
+    group = object.__new__(groupClass)
+    for name in groupClass.__slots__:
+        object.__setattr__(group, name, values[name])
+    return group
+
+class SettingsSnapshot(object):
+    """ Immutable versioned state of all the settings. Groups are
+    available as attributes (``snapshot.core.debug``), raw config data is
+    available as `data` dict which must not be changed.
+    """
+    __slots__ = ("version", "timestamp", "data", "groups")
+
+    def __init__(self, version, timestamp, data, groups):
+        object.__setattr__(self, "version", version)
+        object.__setattr__(self, "timestamp", timestamp)
+        object.__setattr__(self, "data", data)
+        object.__setattr__(self, "groups", groups)
+
+    def __getattr__(self, name):
+        try:
+            return self.groups[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        raise Exception("Settings snapshot can't be changed")
 
 class SettingsMeta(type):
     def __setattr__(stype, name, value):
@@ -53,22 +116,23 @@ class SettingsMeta(type):
        else:
            type.__setattr__(stype, name, value)
 
-    def __getattribute__(stype, name):
-        settings = type.__getattribute__(stype, "settings")
-        if name in settings:
-            return DictAccessProxy(name, # group
-                                   settings[name],
-                                   Settings.readonly_settings[name],
-                                   Settings.types[name],
-                                   Settings.comments[name])
-        else:
-            return type.__getattribute__(stype, name)
-
 class Settings(object):
+    """ Settings storage. Every settings group is available as class
+    attribute (``Settings.core.debug`` for example) holding compiled
+    :class:`SettingsGroup` instance.
+
+    All the settings are kept in immutable :class:`SettingsSnapshot`
+    (see :meth:`current`). Update builds new snapshot and replaces the
+    reference, so readers never lock and never see partially updated
+    config. Every snapshot has its own monotonic version number.
+    """
     __metaclass__ = SettingsMeta
     settings = {}
     readonly_settings = []
     types = {}
+    comments = {}
+    group_classes = {}
+    snapshot = SettingsSnapshot(0, None, {}, {})
     recovery = False
     config_lock = threading.Lock()
 
@@ -90,16 +154,23 @@ class Settings(object):
         comments = {}
         actual = 0
         rocount = 0
-        for group, name, ro, stype, comment in descriptors.values():
-            if not group in settings:
+        defaulted = 0
+        for descriptor in descriptors.values():
+            group, name, ro, stype, comment = descriptor[:5]
+            # options registered with default value may be absent in config
+            optional = len(descriptor) > 5
+            if not group in settings and not optional:
                 problems.append("Group '%s' (%s) not found in settings" %
                                 (group, comment))
                 continue
-            groupDict = settings[group]
+            groupDict = settings.get(group, {})
             if not name in groupDict:
-                problems.append("Setting '%s' (%s) not found in group '%s'" %
-                                (name, comment, group))
-                continue
+                if not optional:
+                    problems.append("Setting '%s' (%s) not found in group '%s'" %
+                                    (name, comment, group))
+                    continue
+                groupDict = {name : descriptor[5]}
+                defaulted += 1
             value = groupDict[name]
             rstype = type(value)
             #if stype == str and type(value) == unicode:
@@ -126,45 +197,126 @@ class Settings(object):
         if problems:
             log.settings.error('\n'.join(problems))
             raise Exception("Can't load settings")
-        log.settings.info('%d settings found in config, %d are actual (%d read-only)' % (len(descriptors), actual, rocount))
+        log.settings.info('%d settings found in config, %d are actual (%d read-only, %d defaulted)' % (len(descriptors), actual, rocount, defaulted))
         Settings.readonly_settings = rosettings
         Settings.types = types
         Settings.comments = comments
         Settings.descriptors = descriptors
+        groupClasses = {}
+        for group in newsettings:
+            groupClasses[group] = compile_group(group,
+                                                newsettings[group].keys(),
+                                                rosettings[group],
+                                                types[group],
+                                                comments[group])
+        Settings.group_classes = groupClasses
         Settings.set_config_data(newsettings)
 
+    @staticmethod
+    def current():
+        """ Returns current :class:`SettingsSnapshot`. Snapshot is never
+        changed so it may be used to read several options consistently
+        without any locking.
+        """
+        return Settings.snapshot
+
     @staticmethod
     def set_config_data(settings, **kwargs):
+        """ Installs new config data. `settings` may contain only the
+        changed groups and options, they are merged with the current
+        snapshot and the result is installed as the new snapshot.
+
+        Optional `version` kwarg sets version of the new snapshot (used
+        when config data comes from another process). Versions are
+        monotonic: if given version is not greater than the current one
+        the next version number is used.
+
+        Only options which values were really changed are accounted.
+        If nothing changed new snapshot is not created. Otherwise
+        :meth:`agatsuma.interfaces.AbstractSpell.post_config_update` is
+        called for spells interested in changed groups (see
+        :meth:`agatsuma.interfaces.AbstractSpell.settings_groups`) with
+        `changed` kwarg containing set of changed ``group.option`` names
+        and all the other kwargs passed to this method.
+        """
         from agatsuma.core import Core
         process = multiprocessing.current_process()
         thread = threading.currentThread()
         log.settings.info("Installing new config data in process '%s' with PID %d using thread '%s'" %
                       (str(process.name), process.pid, thread.getName()))
         timestamp = datetime.datetime.now()
+        version = kwargs.pop('version', None)
+        # Only writers are serialized, readers take the current snapshot
         try:
             Settings.config_lock.acquire()
-            Settings.settings.update(settings)
+            previous = Settings.snapshot
+            data = dict(previous.data)
+            delta = {}
+            for groupName, values in settings.items():
+                current = data.get(groupName, {})
+                group = dict(current)
+                for name, value in values.items():
+                    if not name in current or current[name] != value:
+                        group[name] = value
+                        delta["%s.%s" % (groupName, name)] = value
+                data[groupName] = group
+            changedGroups = set(map(lambda fullName: fullName.split('.', 1)[0], delta))
+            if not delta:
+                log.settings.info("Config data not changed, version %d kept" % previous.version)
+                return
+            groups = {}
+            for groupName, values in data.items():
+                groupClass = Settings.group_classes.get(groupName, None)
+                if not groupClass or not groupClass._options.issuperset(values):
+                    groupClass = compile_unregistered_group(groupName, values, groupClass)
+                    Settings.group_classes[groupName] = groupClass
+                if groupName in changedGroups or not groupName in previous.groups:
+                    groups[groupName] = instantiate_group(groupClass, values)
+                else:
+                    groups[groupName] = previous.groups[groupName]
+            if version is None or version <= previous.version:
+                version = previous.version + 1
+            snapshot = SettingsSnapshot(version, timestamp, data, groups)
+            Settings.snapshot = snapshot
+            type.__setattr__(Settings, "settings", data)
+            for groupName, group in groups.items():
+                type.__setattr__(Settings, groupName, group)
+            Settings.configData = {"data": data,
+                                   "delta" : delta,
+                                   "update" : timestamp,
+                                   "version" : version,
+                                  }
         finally:
             Settings.config_lock.release()
-        if settings["core"]["debug_level"] > 0:
-            log.settings.debug("Updated config: %s" % str(Settings.settings))
-        Settings.configData = {"data": settings,
-                               "update" : timestamp,
-                              }
-        spells = Core.instance.spellbook.implementations_of(AbstractSpell)
+        log.settings.info("Config version %d installed, %d options changed" % (version, len(delta)))
+        if data["core"]["debug_level"] > 0:
+            log.settings.debug("Changed options: %s", delta)
+        changed = frozenset(delta)
+        def interested(spell):
+            spellGroups = spell.settings_groups()
+            return spellGroups is None or bool(changedGroups.intersection(spellGroups))
+        spells = Core.instance.spellbook.implementations_of(AbstractSpell,
+                                                            hook = "post_config_update",
+                                                            accept = interested)
         for spell in spells:
-            spell.post_config_update(**kwargs)
+            spell.post_config_update(changed = changed, **kwargs)
+
+    @staticmethod
+    def delta_to_settings(delta):
+        """ Converts dict with ``group.option`` keys into dict of groups
+        suitable for :meth:`set_config_data`
+        """
+        settings = {}
+        for fullName, value in delta.items():
+            groupName, name = fullName.split('.', 1)
+            settings.setdefault(groupName, {})[name] = value
+        return settings
 
     def load(self, settings):
         """
         Should return json-like dictionary of settings
         """
-        def test(objdict):
-            result = {}
-            for item in objdict.iteritems():
-                result[str(item[0])] = item[1]
-            return result
-        return json.loads(settings, object_hook=test)
+        return json.loads(settings, object_hook=str_keys)
 
     def dump(self):
-        return json.dumps(Settings.settings)
+        return json.dumps(Settings.snapshot.data)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: spell_descriptor
+   :synopsis: Lazy spell placeholders
+"""
+
+from agatsuma.spell_manifest import SpellManifest, qualified_name
+
+class SpellDescriptor(object):
+    """ Lightweight placeholder for a spell which module was not imported
+    yet. Descriptors are built from :class:`agatsuma.spell_manifest.SpellManifest`
+    records and have the same identity-related methods as
+    :class:`agatsuma.interfaces.AbstractSpell`, so they may be resolved
+    and registered in :class:`agatsuma.spellbook.Spellbook` like usual
+    spells. Spellbook replaces descriptor with real spell instance
+    (see :meth:`materialize`) when spell is requested first time.
+
+    *For internal usage only*
+    """
+
+    def __init__(self, namespace_name, file_name, description):
+        self.__namespace_name = namespace_name
+        self.__file_name = file_name
+        self.__class_name = str(description["class"])
+        self.__pId = SpellManifest.spell_id(description)
+        self.__pdeps = SpellManifest.deps(description)
+        self.__pProvides = SpellManifest.provides(description)
+        self.__interfaces = frozenset(map(str, description["interfaces"]))
+        self.__hooks = frozenset(map(str, description["hooks"]))
+        settingsGroups = description.get("settings_groups", None)
+        if settingsGroups is not None:
+            settingsGroups = tuple(map(str, settingsGroups))
+        self.config = {'eager_unload' : description.get("eager_unload", False),
+                       'settings_groups' : settingsGroups,
+                      }
+
+    def __repr__(self):
+        return "<spell descriptor %s (%s.%s)>" % (self.__pId,
+                                                 self.__namespace_name,
+                                                 self.__class_name)
+
+    def _remove_dep(self, dep):
+        if dep in self.__pdeps:
+            deps = list(self.__pdeps)
+            deps.remove(dep)
+            self.__pdeps = tuple(deps)
+
+    def spell_id(self):
+        return self.__pId
+
+    def deps(self):
+        return self.__pdeps
+
+    def provides(self):
+        return self.__pProvides
+
+    def file_name(self):
+        return self.__file_name
+
+    def namespace_name(self):
+        return self.__namespace_name
+
+    def interfaces(self):
+        """ Returns set of full names of the classes spell inherits """
+        return self.__interfaces
+
+    def implements(self, InterfaceClass):
+        return qualified_name(InterfaceClass) in self.__interfaces
+
+    def overrides(self, hook):
+        """ Returns ``True`` if spell's class overrides lifecycle `hook`
+        (see :func:`agatsuma.spell_manifest.overridden_hooks`) """
+        return hook in self.__hooks
+
+    def settings_groups(self):
+        return self.config['settings_groups']
+
+    def materialize(self):
+        """ Imports spell's module and instantiates the spell """
+        mod = __import__(self.__namespace_name, {}, {}, '*', -1)
+        instance = getattr(mod, self.__class_name)()
+        if instance.spell_id() != self.__pId:
+            raise Exception("Spell '%s' in '%s' has changed its id to '%s'" %
+                            (self.__pId, self.__namespace_name, instance.spell_id()))
+        instance._set_details(namespace = mod,
+                              namespace_name = mod.__name__,
+                              file_name = self.__file_name)
+        # dependencies may be disconnected while resolving
+        for dep in instance.deps():
+            if not dep in self.__pdeps:
+                instance._remove_dep(dep)
+        return instance
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from agatsuma.minicache import EternalInvariant
+from agatsuma.minicache import GenerationalInvariant
 from agatsuma.core import Core
 from agatsuma.commons.types import to_atom, is_atom
 
@@ -22,9 +22,13 @@ def SpellByStr(spell_id):
     return Core.instance.spellbook.get(to_atom(spell_id))
 
 
-@EternalInvariant
+def _spellbook_version():
+    return Core.instance.spellbook.version()
+
+@GenerationalInvariant(_spellbook_version)
 def Implementations(interface):
-    """Wrapper function for :meth:`agatsuma.core.Core.implementations_of`
-    caches results with :class:`agatsuma.minicache.MiniCache`
+    """Wrapper function for :meth:`agatsuma.spellbook.Spellbook.implementations_of`
+    caches results with :class:`agatsuma.minicache.GenerationalInvariantHelper`
+    so cached results are dropped when spells are registered or eliminated
     """
     return Core.instance.spellbook.implementations_of(interface)
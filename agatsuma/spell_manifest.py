@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: spell_manifest
+   :synopsis: Persistent cache of spell discovery results
+"""
+
+import os
+import json
+
+from agatsuma.commons.types import to_atom, is_atom
+
+def _encode_id(spell_id):
+    if is_atom(spell_id):
+        return {"atom" : str(spell_id)}
+    return spell_id
+
+def _decode_id(spell_id):
+    if type(spell_id) is dict:
+        return to_atom(spell_id["atom"])
+    return str(spell_id)
+
+def qualified_name(cls):
+    """ Returns full name of class `cls` (eg. myapp.foo.bar.SomeClass) """
+    return "%s.%s" % (cls.__module__, cls.__name__)
+
+lifecycle_hooks = ("pre_configure", "post_configure", "post_config_update")
+
+def overridden_hooks(cls):
+    """ Returns list of lifecycle hooks (see `lifecycle_hooks`) which
+    spell class `cls` overrides. Hook is overridden when the nearest class
+    defining it in `cls` MRO is not the base class which introduced it.
+    """
+    hooks = []
+    for hook in lifecycle_hooks:
+        owners = filter(lambda base: hook in base.__dict__, cls.__mro__)
+        if len(owners) > 1 and owners[0] is not owners[-1]:
+            hooks.append(hook)
+    return hooks
+
+class SpellManifest(object):
+    """On-disk cache of spell discovery results used by
+    :class:`agatsuma.enumerator.Enumerator`.
+
+    Every entry is keyed by the path of the module file and remembers file
+    mtime and size, the namespace the file was imported as and descriptions
+    of all the spells found inside it (class name, `spell_id`, `deps`,
+    `provides`, `eager_unload` flag, `settings_groups`, names of all the
+    implemented interfaces and overridden lifecycle hooks). Entries are valid only while file stats are the same, so
+    any modified module is rescanned. Entry also keeps list of files of
+    the modules which were imported for the first time while importing
+    the module (see :meth:`remember_imports`), it's used to prefetch them
+    on the next start.
+
+    :param path: path to JSON file with manifest. It will be created
+        by :meth:`save` if not exists.
+    """
+    format_version = 3
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            f = open(self.path, 'r')
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return
+        if data.get("version", None) == SpellManifest.format_version:
+            self.entries = data.get("modules", {})
+
+    def save(self):
+        """ Writes manifest to disk if it was changed. File is replaced
+        atomically so concurrently starting processes never see
+        partially written manifest.
+        """
+        if not self.dirty:
+            return
+        tmpPath = "%s.%d.tmp" % (self.path, os.getpid())
+        f = open(tmpPath, 'w')
+        try:
+            json.dump({"version" : SpellManifest.format_version,
+                       "modules" : self.entries,
+                      }, f)
+        finally:
+            f.close()
+        os.rename(tmpPath, self.path)
+        self.dirty = False
+
+    @staticmethod
+    def _file_stats(file_name):
+        stat = os.stat(file_name)
+        return [stat.st_mtime, stat.st_size]
+
+    def lookup(self, file_name, namespace):
+        """ Returns list of spell descriptions for module stored in
+        `file_name` or ``None`` if module is unknown or was changed since
+        the last scan. Empty list means that module contains no spells.
+        """
+        entry = self.entries.get(file_name, None)
+        if not entry or entry["namespace"] != namespace:
+            return None
+        try:
+            if entry["stats"] != SpellManifest._file_stats(file_name):
+                return None
+        except OSError:
+            return None
+        return entry["spells"]
+
+    def update(self, file_name, namespace, spells):
+        """ Stores descriptions of `spells` (spell instances) found in module
+        `namespace` loaded from `file_name`.
+        """
+        try:
+            stats = SpellManifest._file_stats(file_name)
+        except OSError:
+            return
+        self.entries[file_name] = {"namespace" : namespace,
+                                   "stats" : stats,
+                                   "spells" : map(SpellManifest.describe, spells),
+                                  }
+        self.dirty = True
+
+    def imports(self, file_name):
+        """ Returns list of files of the modules which were imported along
+        with module stored in `file_name` last time """
+        entry = self.entries.get(file_name, None)
+        if not entry:
+            return []
+        return entry.get("imports", [])
+
+    def remember_imports(self, file_name, files):
+        """ Stores list of files of the modules imported along with module
+        stored in `file_name` (see :meth:`imports`) """
+        entry = self.entries.get(file_name, None)
+        if entry is not None and entry.get("imports", None) != files:
+            entry["imports"] = files
+            self.dirty = True
+
+    def forget_except(self, file_names):
+        """ Removes entries for files not mentioned in `file_names` """
+        for file_name in self.entries.keys():
+            if not file_name in file_names:
+                del self.entries[file_name]
+                self.dirty = True
+
+    @staticmethod
+    def describe(spell):
+        return {"class" : type(spell).__name__,
+                "spell_id" : _encode_id(spell.spell_id()),
+                "deps" : map(_encode_id, spell.deps()),
+                "provides" : map(_encode_id, spell.provides()),
+                "eager_unload" : bool(spell.config.get('eager_unload', False)),
+                "interfaces" : map(qualified_name, type(spell).__mro__[:-1]),
+                "hooks" : overridden_hooks(type(spell)),
+                "settings_groups" : spell.settings_groups(),
+               }
+
+    @staticmethod
+    def spell_id(description):
+        return _decode_id(description["spell_id"])
+
+    @staticmethod
+    def deps(description):
+        return tuple(map(_decode_id, description["deps"]))
+
+    @staticmethod
+    def provides(description):
+        return tuple(map(_decode_id, description["provides"]))
@@ -1,37 +1,182 @@
 # -*- coding: utf-8 -*-
 
+import threading
+
+from agatsuma.log import log
+from agatsuma.spell_manifest import qualified_name, overridden_hooks
+from agatsuma.spell_descriptor import SpellDescriptor
+
+def _interface_names(spell):
+    if isinstance(spell, SpellDescriptor):
+        return spell.interfaces()
+    return map(qualified_name, type(spell).__mro__[:-1])
+
+def _overrides(spell, hook):
+    if isinstance(spell, SpellDescriptor):
+        return spell.overrides(hook)
+    return hook in overridden_hooks(type(spell))
+
 class Spellbook(object):
+    """ Registry of all the connected spells.
+
+    Spellbook may hold :class:`agatsuma.spell_descriptor.SpellDescriptor`
+    instances instead of spells (see `lazy` parameter of
+    :class:`agatsuma.enumerator.Enumerator`). Descriptor is replaced with
+    the real spell when it's requested through :meth:`get`,
+    :meth:`to_list` or :meth:`implementations_of` first time, so spell's
+    module is never imported if application doesn't use it. Spell which
+    module fails to import is logged and eliminated. Lifecycle
+    callbacks should be called on spells returned by
+    :meth:`implementations_of` with `hook` parameter, so spells which
+    don't override the callback are not imported just to call it.
+
+    Spellbook maintains index which maps every class in spells' MRO
+    (by full class name) to tuple of spells in order of registration.
+    Index is updated on :meth:`register` and :meth:`eliminate`, tuples
+    are never changed in place, they are replaced, so readers don't need
+    any locking.
+
+    Every change of spells set increments spellbook version (see
+    :meth:`version`), so caches built on top of spellbook may check if
+    they are still valid.
     """
-    """
-    
+
     def __init__(self):
         """
         """
 
         self.__spellsdict = {}
         self.__spellslist = []
+        self.__index = {}
+        self.__descriptors = 0
+        self.__version = 0
+        self.__lock = threading.Lock()
+
+    def __replace_in_index(self, spell, replacement):
+        for name in _interface_names(spell):
+            implementations = self.__index.get(name, ())
+            if replacement is None:
+                implementations = tuple(filter(lambda entry: entry is not spell,
+                                               implementations))
+            else:
+                implementations = tuple(map(lambda entry: replacement if entry is spell else entry,
+                                            implementations))
+            if implementations:
+                self.__index[name] = implementations
+            elif name in self.__index:
+                del self.__index[name]
+
+    def __materialize(self, spell):
+        if not isinstance(spell, SpellDescriptor):
+            return spell
+        spell_id = spell.spell_id()
+        current = self.__spellsdict.get(spell_id, None)
+        if current is not spell:
+            # already materialized or eliminated
+            return current
+        # module is imported without lock held: it may use spellbook
+        # while being imported
+        try:
+            instance = spell.materialize()
+        except Exception, e:
+            # like enumerator does with modules failed to import
+            log.core.warning('Exception while importing %s: %s' % (spell.namespace_name(), str(e)))
+            instance = None
+        self.__lock.acquire()
+        try:
+            current = self.__spellsdict.get(spell_id, None)
+            if current is not spell:
+                # materialized by another thread meanwhile or eliminated
+                return current
+            if instance is None:
+                log.core.warning('Spell "%s" eliminated' % spell_id)
+                self.__spellslist.remove(spell)
+                del self.__spellsdict[spell_id]
+                self.__replace_in_index(spell, None)
+                self.__descriptors -= 1
+                self.__version += 1
+                return None
+            self.__spellslist[self.__spellslist.index(spell)] = instance
+            self.__spellsdict[spell_id] = instance
+            self.__replace_in_index(spell, instance)
+            self.__descriptors -= 1
+            return instance
+        finally:
+            self.__lock.release()
 
     def get(self, spell_id):
-        return self.__spellsdict.get(spell_id, None)
+        spell = self.__spellsdict.get(spell_id, None)
+        if spell is None:
+            return None
+        return self.__materialize(spell)
 
     def register(self, spell):
-        self.__spellslist.append(spell)
-        self.__spellsdict[spell.spell_id()] = spell
+        self.__lock.acquire()
+        try:
+            self.__spellslist.append(spell)
+            self.__spellsdict[spell.spell_id()] = spell
+            for name in _interface_names(spell):
+                self.__index[name] = self.__index.get(name, ()) + (spell, )
+            if isinstance(spell, SpellDescriptor):
+                self.__descriptors += 1
+            self.__version += 1
+        finally:
+            self.__lock.release()
 
     def eliminate(self, spell):
-        self.__spellslist.remove(spell)
-        del self.__spellsdict[spell.spell_id()]
+        self.__lock.acquire()
+        try:
+            spell = self.__spellsdict[spell.spell_id()]
+            self.__spellslist.remove(spell)
+            del self.__spellsdict[spell.spell_id()]
+            self.__replace_in_index(spell, None)
+            if isinstance(spell, SpellDescriptor):
+                self.__descriptors -= 1
+            self.__version += 1
+        finally:
+            self.__lock.release()
+
+    def version(self):
+        """ Returns number which is changed on every :meth:`register`
+        and :meth:`eliminate` call
+        """
+        return self.__version
 
     def all_names(self):
         return map(lambda p: str(p.spell_id()), self.__spellslist)
 
+    def __materialize_all(self, spells):
+        spells = map(self.__materialize, spells)
+        return filter(lambda spell: spell is not None, spells)
+
     def to_list(self):
-        return self.__spellslist
+        return self.__materialize_all(self.__spellslist)
 
-    def implementations_of(self, InterfaceClass):
-        """ The most important function for Agatsuma-based application.
-        It returns all the spells implementing interface `InterfaceClass`.
+    def entries(self):
+        """ Returns list of registered spells and descriptors of not yet
+        loaded spells without importing anything. Useful when only spells'
+        identity is needed (`spell_id`, `deps`, `config`).
         """
-        return filter(lambda spell: issubclass(type(spell), InterfaceClass),
-                      self.__spellslist)
+        return list(self.__spellslist)
+
+    def implementations_of(self, InterfaceClass, hook = None, accept = None):
+        """ The most important function for Agatsuma-based application.
+        It returns tuple of all the spells implementing interface
+        `InterfaceClass` in order of registration. Lookup doesn't depend on
+        number of spells.
 
+        :param hook: name of lifecycle callback (see
+            :data:`agatsuma.spell_manifest.lifecycle_hooks`). Only spells
+            overriding it are returned.
+        :param accept: predicate called with spell or descriptor before
+            the spell is loaded. Only accepted spells are returned.
+        """
+        implementations = self.__index.get(qualified_name(InterfaceClass), ())
+        if hook:
+            implementations = filter(lambda spell: _overrides(spell, hook), implementations)
+        if accept:
+            implementations = filter(accept, implementations)
+        implementations = tuple(implementations)
+        if self.__descriptors:
+            implementations = tuple(self.__materialize_all(implementations))
+        return implementations
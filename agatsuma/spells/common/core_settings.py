@@ -49,32 +49,31 @@ class SettingsSpell(AbstractSpell, IInternalSpell):
 
         if self.backend:
             log.settings.info("Updating writable settings from storage '%s'..." % self.backend.__class__.__name__)
+            currentValues = self.__writable_settings()
+            storedValues = self.backend.get_many(currentValues)
             updated = 0
-            for groupName in Settings.settings:
-                group = Settings.settings[groupName]
-                newGroup = copy.deepcopy(group)
-                updatedInGroup = 0
-                for setting in group:
-                    if not setting in Settings.readonly_settings[groupName]:
-                        curVal = group[setting]
-                        newVal = self.backend.get("%s.%s" % (groupName, setting), curVal)
-                        if newVal != curVal:
-                            newGroup[setting] = newVal
-                            updated += 1
-                            updatedInGroup += 1
-                    if updatedInGroup:
-                        Settings.settings[groupName] = newGroup
+            newSettings = {}
+            for fullName, curVal in currentValues.items():
+                newVal = storedValues.get(fullName, curVal)
+                if newVal != curVal:
+                    groupName, setting = fullName.split('.', 1)
+                    newSettings.setdefault(groupName, {})[setting] = copy.deepcopy(newVal)
+                    updated += 1
             if updated:
-                Settings.set_config_data(Settings.settings)
+                Settings.set_config_data(newSettings)
             log.settings.info("Settings updated from storage: %d" % updated)
 
-    def save(self):
-        log.settings.info("Writing settings into storage '%s'..." % self.backend.__class__.__name__)
-        written = 0
+    def __writable_settings(self):
+        values = {}
         for groupName in Settings.settings:
             group = Settings.settings[groupName]
             for setting in group:
                 if not setting in Settings.readonly_settings[groupName]:
-                    self.backend.save("%s.%s" % (groupName, setting), group[setting])
-                    written += 1
-        log.settings.info("Settings written into storage: %d" % written)
+                    values["%s.%s" % (groupName, setting)] = group[setting]
+        return values
+
+    def save(self):
+        log.settings.info("Writing settings into storage '%s'..." % self.backend.__class__.__name__)
+        values = self.__writable_settings()
+        self.backend.save_many(values)
+        log.settings.info("Settings written into storage: %d" % len(values))
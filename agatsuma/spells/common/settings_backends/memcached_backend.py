@@ -55,6 +55,24 @@ class MemcachedAbstractSettingsBackend(AbstractSettingsBackend):
                                    pickle.dumps(value)):
             log.settings.critical("Saving setting '%s' failed" % name)
 
+    def get_many(self, currentValues):
+        keys = dict(map(lambda name: (self._getPrefixedKey(name), name),
+                        currentValues.keys()))
+        data = self.connection.get_multi(keys.keys())
+        result = dict(currentValues)
+        for key, value in data.items():
+            if value:
+                result[keys[key]] = pickle.loads(value)
+        return result
+
+    def save_many(self, values):
+        data = {}
+        for name, value in values.items():
+            data[self._getPrefixedKey(name)] = pickle.dumps(value)
+        failed = self.connection.set_multi(data)
+        for key in failed:
+            log.settings.critical("Saving setting '%s' failed" % key)
+
 class MemcachedSettingsSpell(AbstractSpell, IInternalSpell, ISettingsBackendSpell):
     def __init__(self):
         config = {'info' : 'Memcached settings storage',
@@ -55,6 +55,42 @@ class MongoAbstractSettingsBackend(AbstractSettingsBackend):
         except pymongo.errors.AutoReconnect:
             log.settings.critical("Mongo exception during saving %s=%s" % (name, str(value)))
 
+    def get_many(self, currentValues):
+        result = dict(currentValues)
+        try:
+            for data in self.db.find({'name': {'$in': currentValues.keys()}}):
+                if data["name"] in result:
+                    result[data["name"]] = data["value"]
+            self.connection.end_request()
+        except pymongo.errors.AutoReconnect:
+            log.settings.critical("Mongo exception during loading %d settings" % len(currentValues))
+        except Exception, e:
+            log.settings.critical("Unknown exception during loading: %s" % str(e))
+            self.connection.end_request()
+        return result
+
+    def save_many(self, values):
+        try:
+            initBulk = getattr(self.db, 'initialize_unordered_bulk_op', None)
+            if initBulk and values:
+                bulk = initBulk()
+                for name, value in values.items():
+                    bulk.find({'name': name}).upsert().replace_one({'name' : name,
+                                                                    'value': value,
+                                                                   })
+                bulk.execute()
+            else:
+                # pymongo without bulk API, connection is released only once
+                for name, value in values.items():
+                    self.db.update({'name': name},
+                                   {'name' : name,
+                                    'value': value,
+                                   },
+                                   upsert=True)
+            self.connection.end_request()
+        except pymongo.errors.AutoReconnect:
+            log.settings.critical("Mongo exception during saving %d settings" % len(values))
+
 class MongoSettingsSpell(AbstractSpell, IInternalSpell, ISettingsBackendSpell):
     def __init__(self):
         config = {'info' : 'MongoDB settings storage',
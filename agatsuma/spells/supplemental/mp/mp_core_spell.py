@@ -17,11 +17,25 @@ class MPCoreSpell(AbstractSpell, IInternalSpell):
     def pre_configure(self, core):
         #import logging
         log.new_logger("mpcore")
-        core.register_option("!mpcore.workers", int, "Size of working processes pool. Negative to disable")
-        core.register_option("!mpcore.settings_update_timeout", int, "Update timeout for workers (sec)")
+        core.register_option("!mpcore.workers", int, "Minimal size of working processes pool. Negative to disable")
+        core.register_option("!mpcore.max_workers", int, "Maximal size of working processes pool",
+                             default = 0)
+        core.register_option("!mpcore.worker_idle_timeout", int, "Idle workers above minimal pool size are stopped after this timeout (sec)",
+                             default = 60)
+        core.register_option("!mpcore.scale_latency", float, "Pool grows faster when average task latency exceeds this value (sec)",
+                             default = 1.0)
+        core.register_option("!mpcore.task_queues", dict, "Named task queues: {name : {'priority' : int, 'reserved' : workers count}}",
+                             default = {})
+        core.register_option("!mpcore.batch_window", int, "Batched tasks submitted during this time are sent to worker together (ms)",
+                             default = 5)
+        core.register_option("!mpcore.batch_size", int, "Maximal number of tasks in batch",
+                             default = 64)
+        core.register_option("!mpcore.settings_update_timeout", int, "Interval of checking for config changes missed by notifications (sec)")
         core.register_option("!mpcore.pidfile", unicode, "File with PIDs of all Agatsuma's processes")
+        core.register_option("!mpcore.settings_segment_size", int, "Size of shared memory segment for config data (bytes). Zero to share config through manager process",
+                             default = 0)
 
     def post_config_update(self, **kwargs):
         if kwargs.get('update_shared', True):
             log.mpcore.info("Propagating new config data to another processes")
-            MultiprocessingCoreExtension.shared_config_data.update(Settings.configData)
+            MultiprocessingCoreExtension.publish_config(Settings.configData)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: startup_profiler
+   :synopsis: Startup phases tracer
+"""
+
+import gc
+import json
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def _cpu_time():
+    if resource:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+    return time.clock()
+
+def _max_rss():
+    if resource:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return 0
+
+class StartupProfiler(object):
+    """ Records wall time, CPU time and allocation deltas for core
+    initialization phases, spell callbacks and spell module imports.
+
+    Allocations are measured as growth of maximum resident set size (KB).
+    Phases also record difference of number of objects tracked by garbage
+    collector, it's counted once at the beginning and once at the end of
+    phase (counting is proportional to heap size, so it's not done for
+    spell callbacks). Profiling is not free and it's disabled by default.
+    Disabled profiler just runs wrapped code.
+
+    :param enabled: when ``False`` nothing is recorded.
+    """
+
+    def __init__(self, enabled = False):
+        self.enabled = enabled
+        self.records = []
+        self.__path = []
+
+    def __snapshot(self, countObjects = False):
+        objects = None
+        if countObjects:
+            objects = len(gc.get_objects())
+        return (time.time(), _cpu_time(), objects, _max_rss())
+
+    def __record(self, kind, name, start):
+        end = self.__snapshot(start[2] is not None)
+        record = {"kind" : kind,
+                  "name" : "/".join(self.__path + [name]),
+                  "wall" : end[0] - start[0],
+                  "cpu" : end[1] - start[1],
+                  "maxrss_kb" : end[3] - start[3],
+                 }
+        if start[2] is not None:
+            record["objects"] = end[2] - start[2]
+        self.records.append(record)
+
+    @contextmanager
+    def phase(self, name):
+        """ Context manager measuring code inside ``with`` block as phase
+        `name`. Phases may be nested.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = self.__snapshot(True)
+        self.__path.append(name)
+        try:
+            yield
+        finally:
+            self.__path.pop()
+            self.__record("phase", name, start)
+
+    def spell_callback(self, spell, callback, *args, **kwargs):
+        """ Calls method `callback` of `spell` with given arguments
+        and measures it
+        """
+        method = getattr(spell, callback)
+        if not self.enabled:
+            return method(*args, **kwargs)
+        start = self.__snapshot()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self.__record("callback", "%s.%s" % (spell.spell_id(), callback), start)
+
+    def record_imports(self, timings):
+        """ Stores spell modules' import times collected by
+        :class:`agatsuma.enumerator.Enumerator`
+        """
+        if not self.enabled:
+            return
+        for namespace, wall in timings.items():
+            self.records.append({"kind" : "import",
+                                 "name" : namespace,
+                                 "wall" : wall,
+                                })
+
+    def report(self):
+        return {"records" : self.records,
+                "total_wall" : sum(map(lambda record: record["wall"],
+                                       filter(lambda record: record["kind"] == "phase" and
+                                              not "/" in record["name"],
+                                              self.records))),
+               }
+
+    def to_json(self):
+        return json.dumps(self.report(), indent = 2)
+
+    def save(self, path):
+        f = open(path, 'w')
+        try:
+            f.write(self.to_json())
+        finally:
+            f.close()
+
+    def summary(self):
+        """ Returns human-readable report sorted by wall time """
+        lines = ["%-8s %9s %9s %9s %9s  %s" % ("kind", "wall, s", "cpu, s",
+                                               "objects", "rss, KB", "name")]
+        for record in sorted(self.records, key = lambda record: record["wall"],
+                             reverse = True):
+            lines.append("%-8s %9.4f %9s %9s %9s  %s" %
+                         (record["kind"],
+                          record["wall"],
+                          "%.4f" % record["cpu"] if "cpu" in record else "-",
+                          record.get("objects", "-"),
+                          record.get("maxrss_kb", "-"),
+                          record["name"]))
+        return "\n".join(lines)
@@ -1,15 +1,30 @@
 # -*- coding: utf-8 -*-
 
 import datetime
+import time
 import os
 
 from agatsuma.log import log
 from agatsuma.settings import Settings
 from agatsuma.web.tornado.interfaces import AbstractSession
+from session_cache import SessionCache
+from session_codec import SessionCodec
 
 class BaseSessionManager(object):
+    """ Base class for session storages. Loaded sessions are cached in
+    process when ``sessions.cache_size`` option is positive (see
+    :class:`agatsuma.web.tornado.session_cache.SessionCache`), so
+    repeated requests with the same session don't touch storage.
+
+    Storages which keep session data as strings should serialize it with
+    `codec` (see :class:`agatsuma.web.tornado.session_codec.SessionCodec`).
+    """
     def __init__(self):
-        pass
+        self.cache = None
+        if Settings.sessions.cache_size > 0:
+            self.cache = SessionCache(Settings.sessions.cache_size,
+                                      Settings.sessions.cache_ttl)
+        self.codec = SessionCodec(Settings.sessions.compress_threshold)
 
     def _generate_session_id(cls):
         return os.urandom(32).encode('hex')
@@ -23,36 +38,123 @@ class BaseSessionManager(object):
         sess.fill(ip, user_agent)
         return sess
 
+    def _cache_data(self, sessionId, data):
+        if self.cache:
+            expires = time.mktime(self._session_doomsday(data["timestamp"]).timetuple())
+            self.cache.put(sessionId, data, expires)
+
+    def cache_stats(self):
+        """ Returns statistics of sessions cache or ``None`` if cache is
+        disabled """
+        if self.cache:
+            return self.cache.stats()
+
     def load(self, sessionId):
-        sessData = self.load_data(sessionId)
-        log.sessions.debug("Loaded session %s with data %s loaded" % (sessionId, str(sessData)))
+        sessData = None
+        if self.cache:
+            sessData = self.cache.get(sessionId)
+        if sessData is None:
+            sessData = self.load_data(sessionId)
+            if sessData:
+                self._cache_data(sessionId, sessData)
+        log.sessions.debug("Loaded session %s with data %s loaded", sessionId, sessData)
         if sessData:
             if datetime.datetime.now() >= self._session_doomsday(sessData["timestamp"]):
-                log.sessions.debug("Session %s expired and destroyed" % sessionId)
+                log.sessions.debug("Session %s expired and destroyed", sessionId)
+                if self.cache:
+                    self.cache.discard(sessionId)
                 self.destroy_data(sessionId)
                 return None
             sess = AbstractSession(sessionId, sessData)
             sess.saved = True
+            sess.mark_clean()
             return sess
 
-    def save(self, session):
-        session["timestamp"] = datetime.datetime.now()
-        self.save_data(session.id, session.data)
+    def touch_needed(self, session):
+        """ Returns ``True`` if session's timestamp is older than
+        ``sessions.touch_window`` seconds """
+        age = datetime.datetime.now() - session.data["timestamp"]
+        return age >= datetime.timedelta(seconds = Settings.sessions.touch_window)
+
+    def write_plan(self, session, explicit = True):
+        """ Returns kind of write required for `session`: ``"full"`` for
+        new sessions, ``"update"`` for modified sessions (including values
+        changed in place, see
+        :meth:`agatsuma.web.tornado.interfaces.AbstractSession.detect_changes`)
+        and ``"full"`` for unmodified sessions saved explicitly.
+
+        Implicit saves (prolongation of session's life on load) write
+        ``"touch"`` for unmodified sessions which timestamp should be
+        updated (see :meth:`touch_needed`) or return ``None`` when nothing
+        should be written.
+        """
+        if not session.saved:
+            return "full"
+        session.detect_changes()
+        if session.modified:
+            return "update"
+        if explicit:
+            return "full"
+        if self.touch_needed(session):
+            return "touch"
+        return None
+
+    def write(self, session, plan):
+        """ Writes session to storage according to `plan` (see
+        :meth:`write_plan`). Session's timestamp should be already updated.
+        Cookie is not touched, so this method may be called from any thread.
+        """
+        if plan == "full":
+            self.save_data(session.id, session.data)
+        elif plan == "update":
+            changes = dict(map(lambda key: (key, session.data[key]), session.changed))
+            self.update_data(session.id, session.data, changes, session.removed)
+        else:
+            self.touch_data(session.id, session.data)
+        self._cache_data(session.id, session.data)
+
+    def save(self, session, plan = "auto"):
+        """ Writes session to storage according to `plan` (see
+        :meth:`write_plan`). When `plan` is not given it's computed here
+        and session is marked as saved and not modified, otherwise caller
+        should do it after writing session to all the storages.
+        """
+        standalone = plan == "auto"
+        if standalone:
+            plan = self.write_plan(session)
+        if plan:
+            session.data["timestamp"] = datetime.datetime.now()
+            self.write(session, plan)
+        if standalone:
+            session.mark_clean()
+            session.saved = True
+        self.send_cookie(session)
+
+    def send_cookie(self, session):
         if session.handler and not session.cookieSent:
-            log.sessions.debug("Session %s with data %s saved and cookie set" % (session.id, str(session.data)))
+            log.sessions.debug("Session %s with data %s saved and cookie set", session.id, session.data)
             session.handler.set_secure_cookie(u"AgatsumaSessId", session.id)
             session.cookieSent = True
         else:
-            log.sessions.debug("Session %s with data %s saved but cookie not set" % (session.id, str(session.data)))
-        session.saved = True
+            log.sessions.debug("Session %s with data %s saved but cookie not set", session.id, session.data)
+
+    def forget(self, sessionId):
+        """ Removes session from storage and cache. Cookie is not touched,
+        so this method may be called from any thread """
+        if self.cache:
+            self.cache.discard(sessionId)
+        self.destroy_data(sessionId)
 
     def delete(self, session):
-        self.destroy_data(session.id)
+        self.forget(session.id)
+        self.clear_cookie(session)
+        session.saved = False
+
+    def clear_cookie(self, session):
         if session.handler:
             session.handler.clear_cookie("AgatsumaSessId")
         else:
             log.sessions.warning("Session %s with data %s destroyed but cookie not cleared: no handler" % (session.id, str(session.data)))
-        session.saved = False
 
     def cleanup(self):
         """Deletes sessions with timestamps in the past form storage."""
@@ -65,3 +167,14 @@ class BaseSessionManager(object):
     def load_data(self, sessionId):
         """ returns session data if exists, otherwise returns None """
         pass
+
+    def update_data(self, sessionId, data, changes, removed):
+        """ writes changed values (dict `changes`) and removes keys
+        `removed` of session data. Timestamp is always changed. By default
+        the whole `data` is saved """
+        self.save_data(sessionId, data)
+
+    def touch_data(self, sessionId, data):
+        """ writes new timestamp of unmodified session. By default the
+        whole `data` is saved """
+        self.save_data(sessionId, data)
@@ -12,6 +12,13 @@ from agatsuma.errors import EAbstractFunctionCall
 from url import UrlFor
 
 class AgatsumaHandler(HandlerBaseClass):
+    """ Base request handler.
+
+    `task_queue` attribute sets name of task queue (see ``mpcore.task_queues``
+    option) used by :meth:`async` when queue is not specified explicitly.
+    """
+    task_queue = None
+
     def __init__(self, application, request, **kwargs):
         tornado.web.RequestHandler.__init__(self, application, request, **kwargs)
 
@@ -20,10 +27,21 @@ class AgatsumaHandler(HandlerBaseClass):
         for spell in spells:
             spell.before_request_callback(self)
 
-    def async(self, method, args, callback):
-        self.application.pool.apply_async(method,
-                                          (id(self), ) + args,
-                                          callback=self.async_callback(callback))
+    def async(self, method, args, callback, queue = None):
+        self.application.dispatcher.submit(queue or self.task_queue,
+                                           method,
+                                           (id(self), ) + args,
+                                           self.async_callback(callback))
+
+    def async_batched(self, method, args, callback, queue = None):
+        """ The same as :meth:`async` but task may be sent to worker together
+        with another small tasks (see ``mpcore.batch_window`` and
+        ``mpcore.batch_size`` options)
+        """
+        self.application.batcher.submit(queue or self.task_queue,
+                                        method,
+                                        (id(self), ) + args,
+                                        self.async_callback(callback))
 
     def render(self, *args, **kwargs):
         nkwargs = {'UrlFor' : UrlFor}
@@ -43,4 +61,4 @@ class MsgPumpHandler(AgatsumaHandler):
         raise EAbstractFunctionCall()
 
     def wait_for_queue(self, callback):
-        self.application.waitingCallbacks.append(callback)
+        self.application.waitForQueue(callback)
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import copy
+import datetime
 import collections
 
 """
@@ -6,7 +8,19 @@ import collections
     http://github.com/milancermak/tornado/blob/master/tornado/session.py
 """
 
+# values of these types can't be changed in place
+_immutableTypes = frozenset([str, unicode, int, long, float, bool, type(None),
+                             datetime.datetime, datetime.date])
+
 class AbstractSession(collections.MutableMapping):
+    """ Session tracks keys assigned (`changed`) and deleted (`removed`)
+    since the last save, so storages may write only changes or just
+    prolong session's life when nothing is changed.
+
+    Changes inside mutable values (``session["list"].append(1)``) are
+    found by comparison with copies of such values taken when session
+    was loaded or saved (see :meth:`detect_changes`).
+    """
     def __init__(self, sess_id, data): #, manager, handler):
         self.id = sess_id
         self.data = data
@@ -14,6 +28,30 @@ class AbstractSession(collections.MutableMapping):
         self.sessman = None
         self.saved = False
         self.cookieSent = False
+        self.changed = set()
+        self.removed = set()
+        self.pristine = {}
+
+    @property
+    def modified(self):
+        return bool(self.changed or self.removed)
+
+    def mark_clean(self):
+        """ Forgets changes and remembers current values """
+        self.changed = set()
+        self.removed = set()
+        self.pristine = {}
+        for key, value in self.data.iteritems():
+            if not type(value) in _immutableTypes:
+                self.pristine[key] = copy.deepcopy(value)
+
+    def detect_changes(self):
+        """ Adds keys of values changed in place to `changed` """
+        for key, value in self.pristine.iteritems():
+            if key in self.changed or not key in self.data:
+                continue
+            if self.data[key] != value:
+                self.changed.add(key)
 
     def fill(self, ip, user_agent):
         self.data["ip"] = ip
@@ -30,11 +68,13 @@ class AbstractSession(collections.MutableMapping):
 
     def __setitem__(self, key, value):
         self.data[key] = value
-        self.modified = True
+        self.changed.add(key)
+        self.removed.discard(key)
 
     def __delitem__(self, key):
         del self.data[key]
-        self.modified = True
+        self.changed.discard(key)
+        self.removed.add(key)
 
     def keys(self):
         return self.data.keys()
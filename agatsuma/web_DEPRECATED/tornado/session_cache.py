@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import copy
+import time
+import threading
+from collections import OrderedDict
+
+class SessionCache(object):
+    """ Bounded in-process LRU cache of session data.
+
+    Entries are kept not longer than `ttl` seconds and not longer than
+    session's own expiration moment (see `expires` parameter of
+    :meth:`put`). Cache stores deep copies of data, so changes of loaded
+    session don't affect cached entry until session is saved.
+
+    Every process has its own cache, so `ttl` limits time during which
+    process may see data changed by another process.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, sessionId):
+        """ Returns copy of cached data or ``None`` """
+        now = time.time()
+        self.__lock.acquire()
+        try:
+            entry = self.__entries.pop(sessionId, None)
+            if entry is None or entry[0] <= now:
+                self.misses += 1
+                return None
+            # most recently used entries are at the end
+            self.__entries[sessionId] = entry
+            self.hits += 1
+            data = entry[1]
+        finally:
+            self.__lock.release()
+        return copy.deepcopy(data)
+
+    def put(self, sessionId, data, expires = None):
+        """ Stores copy of session `data`. `expires` is unix timestamp of
+        session expiration
+        """
+        deadline = time.time() + self.ttl
+        if expires is not None:
+            deadline = min(deadline, expires)
+        data = copy.deepcopy(data)
+        self.__lock.acquire()
+        try:
+            self.__entries.pop(sessionId, None)
+            self.__entries[sessionId] = (deadline, data)
+            while len(self.__entries) > self.size:
+                self.__entries.popitem(last = False)
+        finally:
+            self.__lock.release()
+
+    def discard(self, sessionId):
+        self.__lock.acquire()
+        try:
+            self.__entries.pop(sessionId, None)
+        finally:
+            self.__lock.release()
+
+    def clear(self):
+        self.__lock.acquire()
+        try:
+            self.__entries.clear()
+        finally:
+            self.__lock.release()
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {"size" : len(self.__entries),
+                "hits" : self.hits,
+                "misses" : self.misses,
+                "hit_ratio" : float(self.hits) / requests if requests else 0.0,
+               }
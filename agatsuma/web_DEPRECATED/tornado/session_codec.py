@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+import time
+import zlib
+import struct
+import datetime
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+MAGIC = "AS"
+# magic, format version, codec id, flags
+_header = struct.Struct("<2sBBB")
+FORMAT_VERSION = 1
+
+FLAG_COMPRESSED = 1
+
+class PickleCodec(object):
+    """ Codec for any picklable values """
+    codec_id = 2
+
+    @staticmethod
+    def encode(data):
+        return pickle.dumps(data, pickle.HIGHEST_PROTOCOL), 0
+
+    @staticmethod
+    def decode(payload, flags):
+        return pickle.loads(payload)
+
+class SessionCodec(object):
+    """ Serializes session data for storages which keep it as strings.
+
+    Payload is pickled with the highest protocol and prefixed with header
+    containing format version, codec id and flags, so format may be
+    changed later without breaking stored sessions. Payloads longer than
+    `compressThreshold` bytes are compressed with zlib. Data without
+    header is treated as plain pickle written by old Agatsuma versions.
+    """
+    def __init__(self, compressThreshold = 1024):
+        self.compressThreshold = compressThreshold
+
+    def encode(self, data):
+        payload, flags = PickleCodec.encode(data)
+        if self.compressThreshold and len(payload) > self.compressThreshold:
+            compressed = zlib.compress(payload, 1)
+            if len(compressed) < len(payload):
+                payload = compressed
+                flags |= FLAG_COMPRESSED
+        return _header.pack(MAGIC, FORMAT_VERSION, PickleCodec.codec_id, flags) + payload
+
+    def decode(self, data):
+        if not data.startswith(MAGIC):
+            # legacy session
+            return pickle.loads(data)
+        magic, version, codecId, flags = _header.unpack_from(data)
+        if version > FORMAT_VERSION:
+            raise Exception("Session format version %d is not supported" % version)
+        if codecId != PickleCodec.codec_id:
+            # marshal codec (id 1) was removed
+            raise Exception("Session codec %d is not supported" % codecId)
+        payload = data[_header.size:]
+        if flags & FLAG_COMPRESSED:
+            payload = zlib.decompress(payload)
+        return PickleCodec.decode(payload, flags)
+
+if __name__ == "__main__":
+    # Compares codec with plain pickle on typical sessions
+    now = datetime.datetime.now()
+    small = {"ip" : "192.168.1.15",
+             "user_agent" : "Mozilla/5.0 (X11; Linux x86_64) Gecko/20100101 Firefox/45.0",
+             "timestamp" : now,
+            }
+    medium = dict(small)
+    medium.update({"user_id" : 15243,
+                   "login" : u"someone",
+                   "roles" : ["user", "editor"],
+                   "cart" : map(lambda i: {"item" : i, "count" : i % 3 + 1, "price" : 9.99 * i},
+                                range(10)),
+                   "flash" : [u"Item added"],
+                  })
+    large = dict(medium)
+    large["history"] = map(lambda i: {"url" : "/catalog/item/%d" % i, "visited" : 1300000000.5 + i},
+                           range(500))
+    # datetimes deep inside data
+    nested = dict(medium)
+    nested["history"] = map(lambda i: {"url" : "/catalog/item/%d" % i, "visited" : now}, range(50))
+
+    def measure(encode, decode, data, rounds):
+        started = time.time()
+        for i in xrange(rounds):
+            encoded = encode(data)
+        encodeTime = time.time() - started
+        started = time.time()
+        for i in xrange(rounds):
+            decoded = decode(encoded)
+        decodeTime = time.time() - started
+        assert decoded == data
+        return len(encoded), encodeTime * 1e6 / rounds, decodeTime * 1e6 / rounds
+
+    # sessions were stored as pickle.dumps(data) before the codec was introduced
+    picklers = [("pickle:0", pickle.dumps, pickle.loads),
+                ("pickle:2", lambda data: pickle.dumps(data, pickle.HIGHEST_PROTOCOL), pickle.loads)]
+    codec = SessionCodec()
+    picklers.append(("codec", codec.encode, codec.decode))
+    print "%-8s %-14s %8s %12s %12s" % ("session", "format", "bytes", "encode, us", "decode, us")
+    for shapeName, data, rounds in (("small", small, 20000),
+                                    ("medium", medium, 5000),
+                                    ("large", large, 200),
+                                    ("nested", nested, 1000)):
+        for name, encode, decode in picklers:
+            size, encodeTime, decodeTime = measure(encode, decode, data, rounds)
+            print "%-8s %-14s %8d %12.1f %12.1f" % (shapeName, name, size, encodeTime, decodeTime)
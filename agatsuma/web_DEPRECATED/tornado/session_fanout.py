@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import copy
+import Queue
+import traceback
+from multiprocessing.pool import ThreadPool
+
+from agatsuma.log import log
+from agatsuma.web.tornado.interfaces import AbstractSession
+
+def _snapshot(session):
+    """ Returns copy of session which may be written while request
+    continues to change the original """
+    snapshot = AbstractSession(session.id, copy.deepcopy(session.data))
+    snapshot.changed = set(session.changed)
+    snapshot.removed = set(session.removed)
+    snapshot.saved = session.saved
+    return snapshot
+
+class SessionFanout(object):
+    """ Performs operations on several session storages concurrently.
+    The first storage is primary.
+
+    Write policies:
+
+    #. ``all`` : writes to all the storages are done in parallel and
+       request waits for all of them.
+    #. ``primary`` : request waits only for primary storage, another
+       storages are written in background.
+    #. ``write_behind`` : all the storages are written in background.
+
+    Every storage has its own writing thread, so writes and removals of
+    sessions are applied to storage in the order they were requested.
+    Errors of primary storage are raised to caller unless it's written
+    in background, errors of other storages are logged.
+
+    Loads are hedged: primary storage is asked first and if it doesn't
+    answer in `hedgeDelay` seconds another storages are asked too. The first
+    found session is returned. Loads are done by pool of `threads` threads.
+    """
+    policies = ("all", "primary", "write_behind")
+
+    def __init__(self, sessmans, policy, hedgeDelay, threads):
+        if not policy in SessionFanout.policies:
+            raise Exception("Unknown session write policy '%s'" % policy)
+        self.sessmans = sessmans
+        self.policy = policy
+        self.hedgeDelay = hedgeDelay
+        self.pool = None
+        self.writers = None
+        if len(sessmans) > 1:
+            self.pool = ThreadPool(threads)
+        if len(sessmans) > 1 or policy == "write_behind":
+            self.writers = map(lambda sessman: ThreadPool(1), sessmans)
+
+    def __call(self, sessman, method, *args):
+        try:
+            return getattr(sessman, method)(*args)
+        except Exception:
+            log.sessions.error("Session storage %s failed in %s: %s",
+                               sessman, method, traceback.format_exc())
+
+    def __fanout(self, method, session, *args):
+        sessmans = self.sessmans
+        if not self.writers:
+            getattr(sessmans[0], method)(session, *args)
+            return
+        # background writes must not see further changes of session
+        target = session
+        if isinstance(session, AbstractSession):
+            target = _snapshot(session)
+        results = []
+        for index, sessman in enumerate(sessmans):
+            if index == 0 and self.policy == "primary":
+                continue
+            if index == 0 and self.policy == "all":
+                # primary storage errors must reach caller
+                results.append(self.writers[0].apply_async(getattr(sessman, method),
+                                                           (target, ) + args))
+            else:
+                results.append(self.writers[index].apply_async(self.__call,
+                                                               (sessman, method, target) + args))
+        if self.policy == "primary":
+            getattr(sessmans[0], method)(session, *args)
+        elif self.policy == "all":
+            for result in results[1:]:
+                result.wait()
+            results[0].get()
+
+    def write(self, session, plan):
+        """ Writes `session` to all the storages (see
+        :meth:`agatsuma.web.tornado.BaseSessionManager.write`) """
+        self.__fanout("write", session, plan)
+
+    def forget(self, sessionId):
+        """ Removes session from all the storages """
+        self.__fanout("forget", sessionId)
+
+    def load(self, sessionId):
+        """ Returns tuple (session, storage) or (``None``, ``None``) """
+        if not self.pool:
+            for sessman in self.sessmans:
+                session = self.__call(sessman, "load", sessionId)
+                if session:
+                    return (session, sessman)
+            return (None, None)
+        answers = Queue.Queue()
+        def ask(sessman):
+            answer = lambda session: answers.put((session, sessman))
+            self.pool.apply_async(self.__call, (sessman, "load", sessionId), callback = answer)
+        ask(self.sessmans[0])
+        waiting = 1
+        try:
+            session, sessman = answers.get(timeout = self.hedgeDelay)
+            waiting -= 1
+            if session:
+                return (session, sessman)
+        except Queue.Empty:
+            pass
+        for sessman in self.sessmans[1:]:
+            ask(sessman)
+            waiting += 1
+        while waiting:
+            session, sessman = answers.get()
+            waiting -= 1
+            if session:
+                return (session, sessman)
+        return (None, None)
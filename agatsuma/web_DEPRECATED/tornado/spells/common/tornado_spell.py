@@ -17,6 +17,6 @@ class TornadoSpell(AbstractSpell, IInternalSpell):
     def pre_configure(self, core):
         log.new_logger("tcore")
         core.register_option("!tornado.port", int, "Web server port")
-        core.register_option("!tornado.logger_pump_timeout", int, "Logging output interval (msec)")
+        core.register_option("!tornado.logger_pump_timeout", int, "Maximal delay of buffered log records sending to main process (msec)")
         core.register_option("!tornado.xheaders", bool, "Support the X-Real-Ip and X-Scheme headers")
         core.register_option("!tornado.ssl_parameters", dict, "SSL options dictionary for tornado http server")
@@ -3,11 +3,6 @@ import re
 import time
 import datetime
 
-try:
-    import cPickle as pickle
-except ImportError:
-    import pickle
-
 from agatsuma import log
 #from agatsuma.settings import Settings
 #from agatsuma import Core
@@ -33,16 +28,20 @@ class MemcachedSessionManager(BaseSessionManager):
         memcachedSpell = Spell(Atom.agatsuma_memcached)
         self.pool = memcachedSpell.get_connection_pool()
 
-    @property
-    def connection(self):
-        with self.pool.reserve() as mc:
-            return mc
-
     def _getPrefixedKey(self, sessionId):
         if self.keyprefix:
             return str("%s_%s" % (self.keyprefix, sessionId))
         return sessionId
 
+    def _getTimestampKey(self, sessionId):
+        # timestamp is stored separately, so touching session doesn't
+        # require rewriting of session data
+        return "%s_ts" % self._getPrefixedKey(sessionId)
+
+    def _expiration_time(self):
+        return int(time.mktime(
+          self._session_doomsday(datetime.datetime.now()).timetuple()))
+
     @staticmethod
     def _parse_memcached_prefix_uri(details):
         # memprefix://prefixname
@@ -57,22 +56,52 @@ class MemcachedSessionManager(BaseSessionManager):
         pass
 
     def destroy_data(self, sessionId):
-        if not self.connection.remove(self._getPrefixedKey(sessionId)):
+        # client is used only while it's reserved, pool may give it to
+        # another thread after that
+        with self.pool.reserve() as mc:
+            mc.delete(self._getTimestampKey(sessionId))
+            deleted = mc.delete(self._getPrefixedKey(sessionId))
+        if not deleted:
             log.sessions.info("Deleting seesion %s failed. It was probably "\
                               "not set or expired" % sessionId)
 
     def load_data(self, sessionId):
-        data = self.connection.get(self._getPrefixedKey(sessionId))
+        key = self._getPrefixedKey(sessionId)
+        tsKey = self._getTimestampKey(sessionId)
+        with self.pool.reserve() as mc:
+            values = mc.get_multi([key, tsKey])
+        data = values.get(key, None)
         if data:
-            return pickle.loads(data)
+            data = self.codec.decode(data)
+            if tsKey in values:
+                data["timestamp"] = datetime.datetime.fromtimestamp(float(values[tsKey]))
+            return data
 
     def save_data(self, sessionId, data):
-        expTime = int(time.mktime(
-          self._session_doomsday(datetime.datetime.now()).timetuple()))
-        if not self.connection.set(self._getPrefixedKey(sessionId),
-                                   pickle.dumps(data), time=expTime):
+        expTime = self._expiration_time()
+        timestamp = repr(time.mktime(data["timestamp"].timetuple()) +
+                         data["timestamp"].microsecond / 1e6)
+        payload = self.codec.encode(data)
+        with self.pool.reserve() as mc:
+            failed = mc.set_multi({self._getPrefixedKey(sessionId) : payload,
+                                   self._getTimestampKey(sessionId) : timestamp,
+                                  }, time=expTime)
+        if failed:
             log.sessions.critical("Saving %s session failed" % sessionId)
 
+    def touch_data(self, sessionId, data):
+        expTime = self._expiration_time()
+        timestamp = repr(time.mktime(data["timestamp"].timetuple()) +
+                         data["timestamp"].microsecond / 1e6)
+        with self.pool.reserve() as mc:
+            # old clients have no memcached touch command, data may be
+            # already expired or evicted
+            touched = hasattr(mc, "touch") and mc.touch(self._getPrefixedKey(sessionId), expTime)
+            if touched and not mc.set(self._getTimestampKey(sessionId), timestamp, time=expTime):
+                log.sessions.critical("Touching %s session failed" % sessionId)
+        if not touched:
+            self.save_data(sessionId, data)
+
 class MemcachedSessionSpell(AbstractSpell, IInternalSpell, ISessionBackendSpell):
     def __init__(self):
         config = {'info' : 'Memcached session storage',
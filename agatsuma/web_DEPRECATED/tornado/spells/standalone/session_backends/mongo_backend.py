@@ -74,8 +74,50 @@ class MongoSessionManager(BaseSessionManager):
             log.sessions.critical("Unknown exception during loading: %s" % str(e))
             self.connection.end_request()
 
+    def _expiration_time(self):
+        return int(time.mktime(self._session_doomsday(datetime.datetime.now()).timetuple()))
+
+    def _update_fields(self, session_id, setFields, unsetFields = None):
+        """ Updates fields of existing session document. Returns ``False``
+        if document is not found (session is expired, removed by cleanup
+        or wasn't replicated yet), so caller should save whole session
+        """
+        modifier = {'$set' : setFields}
+        if unsetFields:
+            modifier['$unset'] = unsetFields
+        try:
+            # write must be acknowledged to know if document exists
+            result = self.db.update({'session_id': session_id}, modifier, safe=True)
+            self.connection.end_request()
+        except pymongo.errors.AutoReconnect:
+            log.sessions.critical("Mongo exception during updating %s" % session_id)
+            # full save would fail the same way
+            return True
+        return bool(result and (result.get('updatedExisting') or result.get('n')))
+
+    def update_data(self, session_id, data, changes, removed):
+        keys = changes.keys() + list(removed)
+        if filter(lambda key: not isinstance(key, basestring) or '.' in key or key.startswith('$'),
+                  keys):
+            # such keys can't be used in field paths
+            self.save_data(session_id, data)
+            return
+        setFields = dict(map(lambda key: ('data.%s' % key, changes[key]), changes))
+        setFields['data.timestamp'] = data['timestamp']
+        setFields['expires'] = self._expiration_time()
+        unsetFields = dict(map(lambda key: ('data.%s' % key, 1), removed))
+        if not self._update_fields(session_id, setFields, unsetFields):
+            self.save_data(session_id, data)
+
+    def touch_data(self, session_id, data):
+        if not self._update_fields(session_id, {'data.timestamp': data['timestamp'],
+                                                'expires': self._expiration_time(),
+                                               }):
+            # document is already removed
+            self.save_data(session_id, data)
+
     def save_data(self, session_id, data):
-        expTime = int(time.mktime(self._session_doomsday(datetime.datetime.now()).timetuple()))
+        expTime = self._expiration_time()
         try:
             self.db.update(
                 {'session_id': session_id}, # equality criteria
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
-import datetime
 import re
+import datetime
 
 from agatsuma import SpellByStr
 from agatsuma import Settings
@@ -8,6 +8,7 @@ from agatsuma import log
 
 from agatsuma.interfaces import AbstractSpell, IInternalSpell
 from agatsuma.web.tornado.interfaces import IRequestSpell, ISessionHandler
+from agatsuma.web.tornado.session_fanout import SessionFanout
 
 from agatsuma.commons.types import Atom
 
@@ -23,6 +24,20 @@ class SessionSpell(AbstractSpell, IInternalSpell, IRequestSpell):
         log.new_logger("sessions")
         core.register_option("!sessions.storage_uris", list, "Storage URIs")
         core.register_option("!sessions.expiration_interval", int, "Default session length in seconds")
+        core.register_option("!sessions.cache_size", int, "Number of sessions cached in every process. Zero to disable cache",
+                             default = 0)
+        core.register_option("!sessions.cache_ttl", int, "Maximal time of session data caching (sec)",
+                             default = 5)
+        core.register_option("!sessions.touch_window", int, "Timestamp of unmodified session is written not more often than once per this interval (sec)",
+                             default = 0)
+        core.register_option("!sessions.write_policy", unicode, "Writing to several storages: 'all', 'primary' (the first storage) or 'write_behind'",
+                             default = u"all")
+        core.register_option("!sessions.hedge_delay", int, "Other storages are asked for session if the first one doesn't answer in this time (msec)",
+                             default = 20)
+        core.register_option("!sessions.fanout_threads", int, "Number of threads for concurrent storages access",
+                             default = 4)
+        core.register_option("!sessions.compress_threshold", int, "Serialized session data longer than this is compressed (bytes). Zero to disable compression",
+                             default = 1024)
 
     def post_configure(self, core):
         log.sessions.info("Initializing Session Storage..")
@@ -41,35 +56,41 @@ class SessionSpell(AbstractSpell, IInternalSpell, IRequestSpell):
                     raise Exception("Session backend improperly configured, spell '%s' not found" % spellName)
             else:
                 raise Exception("Incorrect session storage URI")
+        self.fanout = SessionFanout(self.sessmans,
+                                    Settings.sessions.write_policy,
+                                    Settings.sessions.hedge_delay / 1000.0,
+                                    Settings.sessions.fanout_threads)
 
-    def save_session(self, session):
-        for sessman in self.sessmans:
-            sessman.save(session)
+    def save_session(self, session, explicit = True):
+        primary = self.sessmans[0]
+        plan = primary.write_plan(session, explicit)
+        if plan:
+            session.data["timestamp"] = datetime.datetime.now()
+            self.fanout.write(session, plan)
+        session.mark_clean()
+        session.saved = True
+        # handler may be used only in request's thread
+        primary.send_cookie(session)
 
     def delete_session(self, session):
-        for sessman in self.sessmans:
-            sessman.delete(session)
+        self.fanout.forget(session.id)
+        self.sessmans[0].clear_cookie(session)
+        session.saved = False
 
     def before_request_callback(self, handler):
         if isinstance(handler, ISessionHandler):
             cookie = handler.get_secure_cookie("AgatsumaSessId")
-            log.sessions.debug("Loading session for %s" % cookie)
+            log.sessions.debug("Loading session for %s", cookie)
             session = None
             if cookie:
-                for sessman in self.sessmans:
-                    session = sessman.load(cookie)
-                    if session:
-                        session.handler = handler
-                        # Update timestamp if left time < than elapsed time
-                        timestamp = session["timestamp"]
-                        now = datetime.datetime.now()
-                        elapsed = now - timestamp
-                        left = (sessman._session_doomsday(timestamp)- now)
-                        if elapsed >= left:
-                            log.sessions.debug("Updating timestamp for session %s (E: %s, L: %s)" %
-                                               (cookie, str(elapsed), str(left)))
-                            self.save_session(session)
-                        break
+                session, sessman = self.fanout.load(cookie)
+                if session:
+                    session.handler = handler
+                    # Prolong session if it wasn't done recently
+                    if sessman.touch_needed(session):
+                        log.sessions.debug("Updating timestamp for session %s (%s)",
+                                           cookie, session["timestamp"])
+                        self.save_session(session, explicit = False)
             if not session:
                 session = self.sessmans[0].new(handler.request.remote_ip,
                                            handler.request.headers["User-Agent"])
@@ -22,7 +22,7 @@ class TornadoSpell(AbstractSpell, IInternalSpell, ISetupSpell, IPoolEventSpell):
     def pre_configure(self, core):
         log.new_logger("tcore")
         core.register_option("!tornado.cookie_secret", unicode, "cookie secret")
-        core.register_option("!tornado.message_pump_timeout", int, "Message pushing interval (msec)")
+        core.register_option("!tornado.message_pump_timeout", int, "Message pushing interval when message queue can not be watched by IOLoop (msec)")
         core.register_option("!tornado.app_parameters", dict, "Kwarg parameters for tornado application")
 
     def __process_url(self, core, url):
@@ -22,7 +22,8 @@ else:
 
 from agatsuma import Settings
 from agatsuma.errors import EAbstractFunctionCall
-from agatsuma import log, MPLogHandler
+from agatsuma import log
+from agatsuma.log_transport import log_pipe, FramedLogHandler, FramedLogCollector
 
 class TornadoMPExtension(MultiprocessingCoreExtension):
     @staticmethod
@@ -30,10 +31,11 @@ class TornadoMPExtension(MultiprocessingCoreExtension):
         return "tornadomp"
 
     def _start_settings_updater(self):
-        configChecker = tornado.ioloop.PeriodicCallback(MultiprocessingCoreExtension._update_settings,
-                                                        1000 * Settings.mpcore.settings_update_timeout,
-                                                        io_loop=Core.instance.ioloop)
-        configChecker.start()
+        # watcher thread only wakes up ioloop, config is installed in ioloop's thread
+        ioloop = Core.instance.ioloop
+        applyInLoop = lambda: ioloop.add_callback(MultiprocessingCoreExtension._update_settings)
+        MultiprocessingCoreExtension._start_settings_watcher(Settings.mpcore.settings_update_timeout,
+                                                             applyInLoop)
 
 supported_tornado_version="0.2"
 
@@ -58,26 +60,20 @@ class TornadoCore(Core):
     def _stop(self):
         #self.HTTPServer.stop()
         self.ioloop.stop()
+        log.rootHandler.flush()
+        self.logger.logCollector.stop()
         Core._stop(self)
 
-    def processLog(self):
-        while not log.instance.logQueue.empty():
-            try:
-                message = log.instance.logQueue.get_nowait()
-                log.rootHandler.realHandler.emit(message)
-            except Queue.Empty:
-                log.instance.rootHandler.realHandler.emit("log: raised Queue.Empty")
-
     def __updateLogger(self):
-        #from agatsuma.settings import Settings
-        pumpTimeout = Settings.tornado.logger_pump_timeout
-        self.logger.logQueue = MPQueue()
+        # records are written by collector thread, so logging doesn't
+        # take time of IOLoop
+        flushInterval = Settings.tornado.logger_pump_timeout / 1000.0
+        writer, reader = log_pipe()
         log.instance = self.logger
-        self.logger.logPump = tornado.ioloop.PeriodicCallback(self.processLog,
-                                                              pumpTimeout,
-                                                              io_loop=self.ioloop)
-        log.rootHandler = MPLogHandler(self.logger.logQueue, log.rootHandler)
-        self.logger.logPump.start()
+        self.logger.logCollector = FramedLogCollector(reader, log.rootHandler, writer)
+        log.rootHandler = FramedLogHandler(writer,
+                                           log.rootHandler,
+                                           flush_interval = flushInterval)
 
     def start(self):
         self.ioloop = tornado.ioloop.IOLoop.instance()
@@ -120,8 +116,15 @@ class TornadoCore(Core):
 class TornadoStandaloneCore(TornadoCore, TornadoAppClass):
     """Implements standalone Tornado server, useful to develop
     lightweight asynchronous web applications
+
+    Reading end of message queue is registered in IOLoop, so messages from
+    workers are processed as soon as they arrive, at most
+    ``messagePumpBatch`` messages per IOLoop iteration. If queue's file
+    descriptor is not available queue is polled every
+    ``tornado.message_pump_timeout`` ms.
     """
-    
+    messagePumpBatch = 64
+
     def __init__(self, app_directory, appConfig, **kwargs):
         """
         """
@@ -133,6 +136,8 @@ class TornadoStandaloneCore(TornadoCore, TornadoAppClass):
         kwargs['spell_directories'] = spell_directories
 
         self.URIMap = []
+        self.eventDrivenPump = False
+        self.waitingCallbacks = []
         TornadoCore.__init__(self, app_directory, appConfig, **kwargs)
         self.mpHandlerInstances = WeakValueDictionary()
         tornadoSettings = {'debug': Settings.core.debug, # autoreload
@@ -145,24 +150,42 @@ class TornadoStandaloneCore(TornadoCore, TornadoAppClass):
     def _before_ioloop_start(self):
         if self.messagePumpNeeded and self.pool:
             TornadoCore.mqueue = MPQueue()
-            pumpTimeout = Settings.tornado.message_pump_timeout
-            mpump = tornado.ioloop.PeriodicCallback(self._messagePump,
-                                                    pumpTimeout,
-                                                    io_loop=self.ioloop)
-            log.tcore.debug("Starting message pump...")
-            mpump.start()
+            try:
+                fd = self.mqueue._reader.fileno()
+            except (AttributeError, IOError, OSError):
+                fd = None
+            if fd is not None:
+                log.tcore.debug("Registering message queue's descriptor %d in IOLoop..." % fd)
+                self.eventDrivenPump = True
+                self.ioloop.add_handler(fd,
+                                        lambda fd, events: self._messagePump(),
+                                        tornado.ioloop.IOLoop.READ)
+            else:
+                pumpTimeout = Settings.tornado.message_pump_timeout
+                mpump = tornado.ioloop.PeriodicCallback(self._messagePump,
+                                                        pumpTimeout,
+                                                        io_loop=self.ioloop)
+                log.tcore.debug("Starting message pump...")
+                mpump.start()
         else:
             log.tcore.debug("Message pump initiation skipped, it isn't required for any spell")
 
     def _messagePump(self):
         """Extracts messages from message queue if any and pass them to
-        appropriate controller
+        appropriate controller. Callbacks registered with
+        :meth:`waitForQueue` are called when queue is drained.
         """
-        while not self.mqueue.empty():
+        drained = False
+        for i in xrange(self.messagePumpBatch):
+            # IOLoop calls pump again if there are more messages
             try:
                 message = self.mqueue.get_nowait()
+            except Queue.Empty:
+                drained = True
+                break
+            else:
                 if Settings.core.debug_level > 0:
-                    log.tcore.debug("message: '%s'" % str(message))
+                    log.tcore.debug("message: '%s'", message)
                 if message and type(message) is tuple:
                     handlerId = message[0]
                     if handlerId in self.mpHandlerInstances:
@@ -170,16 +193,23 @@ class TornadoStandaloneCore(TornadoCore, TornadoAppClass):
                     else:
                         log.tcore.warning("unknown message recepient: '%s'" % str(message))
                 else:
-                    log.tcore.debug("bad message: '%s'" % str(message))
-            except Queue.Empty:
-                log.tcore.debug("message: raised Queue.Empty")
-
-        if self.waitingCallbacks:
-            try:
-                for callback in self.waitingCallbacks:
-                    callback()
-            finally:
-                self.waitingCallbacks = []
+                    log.tcore.debug("bad message: '%s'", message)
+        if drained and self.waitingCallbacks:
+            callbacks = self.waitingCallbacks
+            self.waitingCallbacks = []
+            for callback in callbacks:
+                callback()
+
+    def waitForQueue(self, callback):
+        """ `callback` will be called after processing of messages which
+        are already in queue
+        """
+        self.waitingCallbacks.append(callback)
+        if self.eventDrivenPump and len(self.waitingCallbacks) == 1:
+            # queue's descriptor may never become readable, so pump is
+            # called explicitly. It processes messages available now and
+            # then calls waiting callbacks
+            self.ioloop.add_callback(self._messagePump)
 
     def handlerInitiated(self, handler):
         # references are weak, so handler will be correctly destroyed and removed from dict automatically
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'agatsuma'))
+
+from dependency_resolver import DependencyResolver
+
+class Spell(object):
+    def __init__(self, spell_id, deps = ()):
+        self.id = spell_id
+        self.pdeps = tuple(deps)
+
+    def spell_id(self):
+        return self.id
+
+    def deps(self):
+        return self.pdeps
+
+    def _remove_dep(self, dep):
+        self.pdeps = tuple(filter(lambda spellId: spellId != dep, self.pdeps))
+
+def resolver(spells, helpers = ()):
+    return DependencyResolver(dict(map(lambda spell: (spell.spell_id(), spell), spells)),
+                              helpers)
+
+class DependencyResolverTest(unittest.TestCase):
+    def test_independent_spells_sorted_by_id(self):
+        result = resolver([Spell("c"), Spell("a"), Spell("b")])
+        self.assertEqual(result.resolve(), ["a", "b", "c"])
+
+    def test_dependencies_first(self):
+        result = resolver([Spell("a", ["b"]), Spell("b", ["c"]), Spell("c"), Spell("d", ["a"])])
+        self.assertEqual(result.resolve(), ["c", "b", "a", "d"])
+        self.assertEqual(result.cycles, [])
+        self.assertEqual(result.disconnected, [])
+
+    def test_cycle_after_external_deps(self):
+        result = resolver([Spell("a", ["b"]), Spell("b", ["a", "c"]), Spell("c")])
+        self.assertEqual(result.resolve(), ["c", "a", "b"])
+        self.assertEqual(result.cycles, [["a", "b", "a"]])
+
+    def test_cycle_dependents(self):
+        result = resolver([Spell("a", ["b"]), Spell("b", ["a"]), Spell("0", ["b"]), Spell("z")])
+        self.assertEqual(result.resolve(), ["a", "b", "0", "z"])
+
+    def test_self_dependency(self):
+        result = resolver([Spell("a", ["a"]), Spell("b", ["a"])])
+        self.assertEqual(result.resolve(), ["a", "b"])
+        self.assertEqual(result.cycles, [["a", "a"]])
+
+    def test_transitive_disconnect(self):
+        result = resolver([Spell("a", ["missing"]), Spell("b", ["a"]), Spell("c", ["b"]),
+                           Spell("d"), Spell("e", ["d"])])
+        self.assertEqual(result.resolve(), ["d", "e"])
+        self.assertEqual(result.disconnected, [("a", "missing"), ("b", "a"), ("c", "b")])
+
+    def test_disconnected_cycle(self):
+        result = resolver([Spell("a", ["b", "missing"]), Spell("b", ["a"]), Spell("c")])
+        self.assertEqual(result.resolve(), ["c"])
+        self.assertEqual(sorted(map(lambda item: item[0], result.disconnected)), ["a", "b"])
+        self.assertEqual(result.cycles, [])
+
+    def test_helper_ordering(self):
+        helper = Spell("[db]", ["mongo", "sqla"])
+        result = resolver([Spell("mongo"), Spell("sqla"), helper, Spell("app", ["[db]"])],
+                          ["[db]"])
+        self.assertEqual(result.resolve(), ["mongo", "sqla", "[db]", "app"])
+
+    def test_helper_keeps_connected_providers(self):
+        helper = Spell("[db]", ["mongo", "sqla"])
+        result = resolver([Spell("mongo", ["pymongo"]), Spell("sqla"), helper,
+                           Spell("app", ["[db]"])],
+                          ["[db]"])
+        self.assertEqual(result.resolve(), ["sqla", "[db]", "app"])
+        self.assertEqual(helper.deps(), ("sqla", ))
+        self.assertEqual(result.disconnected, [("mongo", "pymongo")])
+
+if __name__ == "__main__":
+    unittest.main()
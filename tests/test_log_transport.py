@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import logging
+import threading
+import unittest
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, rootDir)
+
+from agatsuma.log_transport import LogEventWriter, LogEventReader, FRAME_NAME, _frameHeader
+
+class Text(unicode):
+    pass
+
+class Name(str):
+    pass
+
+def makeRecord(name, msg, args, lineno = 10):
+    return logging.LogRecord(name, logging.INFO, __file__, lineno, msg, args, None, "test")
+
+class LogTransportTest(unittest.TestCase):
+    def setUp(self):
+        readFd, writeFd = os.pipe()
+        self.writer = LogEventWriter(writeFd, threading.Lock())
+        self.reader = LogEventReader(readFd)
+
+    def tearDown(self):
+        for fd in (self.reader.fd, self.writer.fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def test_roundtrip(self):
+        record = makeRecord("agatsuma.sessions", u"Session %s saved: %r",
+                            ("f00d", {"visits" : 3, u"user" : [1, 2.5, None]}))
+        record.exc_text = "Traceback: nothing"
+        self.writer.write([record])
+        restored = self.reader.read()
+        self.assertEqual(restored.name, "agatsuma.sessions")
+        self.assertEqual(restored.getMessage(), record.getMessage())
+        self.assertEqual(restored.args, record.args)
+        self.assertEqual((restored.levelno, restored.lineno, restored.created),
+                         (record.levelno, record.lineno, record.created))
+        self.assertEqual((restored.funcName, restored.process, restored.exc_text),
+                         ("test", os.getpid(), "Traceback: nothing"))
+
+    def test_names_interned_once(self):
+        records = [makeRecord("a", "one", ()), makeRecord("b", "two", ()),
+                   makeRecord("a", "three", ())]
+        writer = LogEventWriter(None, None)
+        frames = writer.encode(records)
+        types = map(lambda frame: _frameHeader.unpack_from(frame)[1], frames)
+        self.assertEqual(types.count(FRAME_NAME), 2)
+        self.assertEqual(len(writer.encode([makeRecord("b", "four", ())])), 1)
+        self.writer.write(records)
+        self.writer.write([makeRecord("b", "four", ())])
+        self.assertEqual(map(lambda i: self.reader.read().name, range(4)), ["a", "b", "a", "b"])
+
+    def test_subclasses_rendered(self):
+        records = [makeRecord("x", Text(u"unicode subclass %s"), (Text(u"ж"), )),
+                   makeRecord("x", "str subclass %s", (Name("name"), )),
+                   makeRecord("x", "bytearray %s", (bytearray("bytes"), )),
+                   makeRecord("x", Text(u"plain ж"), ())]
+        self.writer.write(records)
+        for record in records:
+            restored = self.reader.read()
+            self.assertEqual(restored.getMessage(), record.getMessage())
+            self.assertTrue(type(restored.getMessage()) in (str, unicode))
+
+    def test_stop(self):
+        self.writer.write([makeRecord("a", "one", ())])
+        self.writer.write_stop()
+        self.assertEqual(self.reader.read().getMessage(), "one")
+        self.assertEqual(self.reader.read(), None)
+
+    def test_eof(self):
+        self.writer.write([makeRecord("a", "one", ())])
+        os.close(self.writer.fd)
+        self.assertEqual(self.reader.read().getMessage(), "one")
+        self.assertRaises(EOFError, self.reader.read)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import datetime
+import unittest
+import cPickle as pickle
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'agatsuma', 'web_DEPRECATED', 'tornado'))
+
+from session_codec import SessionCodec, PickleCodec, MAGIC, FORMAT_VERSION, _header
+
+class Markup(unicode):
+    pass
+
+class Name(str):
+    pass
+
+class Counter(int):
+    pass
+
+class Moment(datetime.datetime):
+    pass
+
+class FixedOffset(datetime.tzinfo):
+    def utcoffset(self, dt):
+        return datetime.timedelta(hours = 3)
+
+    def dst(self, dt):
+        return datetime.timedelta(0)
+
+def codec_id(encoded):
+    return _header.unpack_from(encoded)[2]
+
+class SessionCodecTest(unittest.TestCase):
+    def setUp(self):
+        self.codecs = [SessionCodec(), SessionCodec(0)]
+        self.now = datetime.datetime(2011, 3, 14, 15, 9, 26, 535897)
+
+    def roundtrip(self, data):
+        for codec in self.codecs:
+            encoded = codec.encode(data)
+            decoded = codec.decode(encoded)
+            self.assertEqual(decoded, data)
+            self.assertEqual(type(decoded), type(data))
+        return decoded
+
+    def test_builtin_values(self):
+        data = {"timestamp" : self.now,
+                "ip" : "127.0.0.1",
+                "login" : u"пользователь",
+                "roles" : ["user", "editor"],
+                "pair" : (1, 2L),
+                "tags" : set(["a", "b"]),
+                "price" : 9.99,
+                "admin" : False,
+                "none" : None,
+               }
+        decoded = self.roundtrip(data)
+        self.assertEqual(type(decoded["timestamp"]), datetime.datetime)
+        self.assertEqual(codec_id(self.codecs[0].encode(data)), PickleCodec.codec_id)
+
+    def test_nested_datetimes(self):
+        data = {"timestamp" : self.now,
+                "history" : [{"visited" : self.now, "url" : "/"}],
+                "range" : (self.now, self.now),
+               }
+        decoded = self.roundtrip(data)
+        self.assertEqual(type(decoded["history"][0]["visited"]), datetime.datetime)
+        self.assertEqual(type(decoded["range"]), tuple)
+
+    def test_unicode_subclass(self):
+        data = {"flash" : [Markup(u"<b>Saved</b>")]}
+        decoded = self.roundtrip(data)
+        self.assertEqual(type(decoded["flash"][0]), Markup)
+
+    def test_str_subclass(self):
+        decoded = self.roundtrip({"name" : Name("user")})
+        self.assertEqual(type(decoded["name"]), Name)
+
+    def test_int_subclass(self):
+        decoded = self.roundtrip({"count" : Counter(5)})
+        self.assertEqual(type(decoded["count"]), Counter)
+
+    def test_bytearray(self):
+        decoded = self.roundtrip({"blob" : bytearray("\x00\x01\x02")})
+        self.assertEqual(type(decoded["blob"]), bytearray)
+
+    def test_subclass_as_key(self):
+        decoded = self.roundtrip({Name("key") : 1})
+        self.assertEqual(type(decoded.keys()[0]), Name)
+
+    def test_subclass_in_set(self):
+        decoded = self.roundtrip({"tags" : set([Markup(u"a")])})
+        self.assertEqual(type(list(decoded["tags"])[0]), Markup)
+
+    def test_aware_datetime(self):
+        moment = datetime.datetime(2011, 3, 14, 15, 9, 26, tzinfo = FixedOffset())
+        decoded = self.roundtrip({"timestamp" : moment})
+        self.assertEqual(decoded["timestamp"].utcoffset(), datetime.timedelta(hours = 3))
+
+    def test_datetime_subclass_in_nested_data(self):
+        decoded = self.roundtrip({"history" : [Moment(2011, 3, 14)]})
+        self.assertEqual(type(decoded["history"][0]), Moment)
+
+    def test_compression(self):
+        data = {"timestamp" : self.now, "history" : ["/catalog/item/%d" % i for i in range(1000)]}
+        compressed, plain = map(lambda codec: codec.encode(data), self.codecs)
+        self.assertTrue(len(compressed) < len(plain))
+        for codec in self.codecs:
+            self.assertEqual(codec.decode(compressed), data)
+            self.assertEqual(codec.decode(plain), data)
+
+    def test_unknown_codec(self):
+        # payload of removed marshal codec
+        encoded = _header.pack(MAGIC, FORMAT_VERSION, 1, 0) + "\x00"
+        self.assertRaises(Exception, self.codecs[0].decode, encoded)
+
+    def test_legacy_pickle(self):
+        data = {"timestamp" : self.now, "flash" : [Markup(u"<b>Saved</b>")]}
+        for protocol in (0, 2):
+            for codec in self.codecs:
+                self.assertEqual(codec.decode(pickle.dumps(data, protocol)), data)
+
+if __name__ == "__main__":
+    unittest.main()
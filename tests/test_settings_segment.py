@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import logging
+import unittest
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, rootDir)
+sys.path.insert(0, os.path.join(rootDir, 'agatsuma', 'core_extensions', 'python_mp'))
+
+import agatsuma
+if not hasattr(agatsuma, 'log'):
+    # package doesn't export its logging system yet
+    class Log(object):
+        def __getattr__(self, name):
+            return logging.getLogger(name)
+    agatsuma.log = Log()
+
+from agatsuma.settings import compile_unregistered_group, instantiate_group
+from settings_segment import SettingsSegment
+
+class SettingsSegmentTest(unittest.TestCase):
+    def setUp(self):
+        self.segment = SettingsSegment(64 * 1024)
+        self.config = {"core" : {"debug" : True, "name" : u"agatsuma"},
+                       "mpcore" : {"workers" : 2, "task_queues" : {"default" : {"priority" : 0}}},
+                      }
+
+    def test_empty(self):
+        self.assertEqual(self.segment.read(), (None, 0))
+        self.assertEqual(self.segment.version(), 0)
+
+    def test_roundtrip(self):
+        self.segment.write(self.config, 1)
+        self.assertEqual(self.segment.read(), (self.config, 1))
+        self.assertEqual(self.segment.version(), 1)
+
+    def test_names_are_str(self):
+        self.segment.write(self.config, 1)
+        data, version = self.segment.read()
+        for groupName, values in data.items():
+            self.assertEqual(type(groupName), str)
+            for name in values:
+                self.assertEqual(type(name), str)
+        self.assertEqual(type(data["mpcore"]["task_queues"].keys()[0]), str)
+        self.assertEqual(type(data["core"]["name"]), unicode)
+
+    def test_new_group(self):
+        self.segment.write(self.config, 1)
+        config = dict(self.config)
+        config["sessions"] = {"cache_size" : 100, "codec" : u"pickle"}
+        self.segment.write(config, 2)
+        data, version = self.segment.read()
+        self.assertEqual(version, 2)
+        groupName = filter(lambda name: not name in self.config, data.keys())[0]
+        groupClass = compile_unregistered_group(groupName, data[groupName])
+        group = instantiate_group(groupClass, data[groupName])
+        self.assertEqual(group.cache_size, 100)
+        self.assertEqual(group.codec, u"pickle")
+
+    def test_generations(self):
+        for version in range(1, 6):
+            self.segment.write({"core" : {"version" : version}}, version)
+        self.assertEqual(self.segment.read(), ({"core" : {"version" : 5}}, 5))
+
+    def test_too_large(self):
+        segment = SettingsSegment(256)
+        self.assertRaises(Exception, segment.write, {"core" : {"data" : "x" * 1024}}, 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import logging
+import threading
+import unittest
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, rootDir)
+sys.path.insert(0, os.path.join(rootDir, 'agatsuma', 'core_extensions', 'python_mp'))
+
+import agatsuma
+if not hasattr(agatsuma, 'log'):
+    # package doesn't export its logging system yet
+    class Log(object):
+        def __getattr__(self, name):
+            return logging.getLogger(name)
+    agatsuma.log = Log()
+
+from task_dispatcher import TaskDispatcher
+
+class Pool(object):
+    """ Runs tasks only when test completes them """
+    def __init__(self, workers):
+        self.workers = workers
+        self.started = []
+        self.lock = threading.Lock()
+
+    def size(self):
+        return self.workers
+
+    def apply_async(self, func, args, callback, submitted = None, partial = None):
+        self.lock.acquire()
+        try:
+            self.started.append((func, args, callback))
+        finally:
+            self.lock.release()
+
+    def complete(self, index = 0):
+        self.lock.acquire()
+        try:
+            func, args, callback = self.started.pop(index)
+        finally:
+            self.lock.release()
+        callback(func(*args))
+
+    def names(self):
+        return map(lambda task: task[1][1][0], self.started)
+
+def fail(name):
+    raise Exception("Task %s failed" % name)
+
+class TaskDispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.results = []
+
+    def submit(self, dispatcher, queueName, name, method = lambda name: name):
+        dispatcher.submit(queueName, method, (name, ), self.results.append)
+
+    def test_never_exceeds_pool_size(self):
+        pool = Pool(2)
+        dispatcher = TaskDispatcher(pool, {})
+        for name in "abcd":
+            self.submit(dispatcher, None, name)
+        self.assertEqual(pool.names(), ["a", "b"])
+        self.assertEqual(dispatcher.waiting(), 2)
+        self.assertEqual(pool.extra_pending(), 2)
+        pool.complete()
+        self.assertEqual(pool.names(), ["b", "c"])
+        self.assertEqual(self.results, ["a"])
+
+    def test_priority_and_fifo(self):
+        pool = Pool(1)
+        dispatcher = TaskDispatcher(pool, {"low" : {"priority" : -1},
+                                           "high" : {"priority" : 10}})
+        self.submit(dispatcher, "low", "first")
+        self.submit(dispatcher, "low", "low1")
+        self.submit(dispatcher, "default", "default")
+        self.submit(dispatcher, "high", "high1")
+        self.submit(dispatcher, "high", "high2")
+        for i in range(5):
+            pool.complete()
+        self.assertEqual(self.results, ["first", "high1", "high2", "default", "low1"])
+
+    def test_reservation(self):
+        pool = Pool(3)
+        dispatcher = TaskDispatcher(pool, {"io" : {"reserved" : 1}})
+        for name in "abc":
+            self.submit(dispatcher, None, name)
+        # one worker is kept for "io"
+        self.assertEqual(pool.names(), ["a", "b"])
+        self.submit(dispatcher, "io", "io1")
+        self.submit(dispatcher, "io", "io2")
+        self.assertEqual(pool.names(), ["a", "b", "io1"])
+        # "io" runs its reserved task, so it competes for free workers
+        pool.complete(0)
+        self.assertEqual(pool.names(), ["b", "io1", "c"])
+        pool.complete(1)
+        self.assertEqual(pool.names(), ["b", "c", "io2"])
+
+    def test_reserved_queue_uses_free_workers(self):
+        pool = Pool(2)
+        dispatcher = TaskDispatcher(pool, {"io" : {"reserved" : 1}})
+        for name in ("io1", "io2", "io3"):
+            self.submit(dispatcher, "io", name)
+        self.assertEqual(pool.names(), ["io1", "io2"])
+
+    def test_pool_growth(self):
+        pool = Pool(1)
+        dispatcher = TaskDispatcher(pool, {})
+        for name in "abc":
+            self.submit(dispatcher, None, name)
+        pool.workers = 3
+        pool.on_resize()
+        self.assertEqual(pool.names(), ["a", "b", "c"])
+
+    def test_failed_task(self):
+        pool = Pool(1)
+        dispatcher = TaskDispatcher(pool, {})
+        self.submit(dispatcher, None, "bad", fail)
+        self.submit(dispatcher, None, "good")
+        pool.complete()
+        pool.complete()
+        self.assertEqual(self.results, ["good"])
+        stats = dispatcher.stats()["default"]
+        self.assertEqual((stats["failed"], stats["completed"], stats["running"]), (1, 1, 0))
+
+    def test_unknown_queue(self):
+        dispatcher = TaskDispatcher(Pool(1), {})
+        self.assertRaises(Exception, dispatcher.submit, "missing", len, ("x", ), None)
+
+    def test_drain_timeout_drops_queued(self):
+        pool = Pool(1)
+        dispatcher = TaskDispatcher(pool, {})
+        for name in "abc":
+            self.submit(dispatcher, None, name)
+        self.assertEqual(dispatcher.drain(0.05), (2, 1))
+        self.assertEqual(dispatcher.waiting(), 0)
+        pool.complete()
+        self.assertEqual(pool.names(), [])
+        self.assertEqual(self.results, ["a"])
+
+    def test_drain_waits_for_callbacks(self):
+        pool = Pool(2)
+        dispatcher = TaskDispatcher(pool, {})
+        for name in "abcde":
+            self.submit(dispatcher, None, name)
+        stop = threading.Event()
+        def worker():
+            while not stop.isSet():
+                if pool.started:
+                    pool.complete()
+                else:
+                    stop.wait(0.001)
+        thread = threading.Thread(target = worker)
+        thread.start()
+        try:
+            self.assertEqual(dispatcher.drain(5), (0, 0))
+        finally:
+            stop.set()
+            thread.join()
+        self.assertEqual(sorted(self.results), list("abcde"))
+
+    def test_drain_idle(self):
+        dispatcher = TaskDispatcher(Pool(1), {})
+        self.assertEqual(dispatcher.drain(0), (0, 0))
+
+if __name__ == "__main__":
+    unittest.main()